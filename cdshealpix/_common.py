@@ -0,0 +1,99 @@
+import astropy.units as u
+from astropy.coordinates import SkyCoord, ICRS, UnitSphericalRepresentation
+import numpy as np
+
+# Number of HEALPix cells at each depth in [0, 29]
+_NPIX_TABLE = tuple(12 * (1 << (2 * depth)) for depth in range(30))
+
+# Raise a ValueError exception if the input 
+# HEALPix cells array contains invalid values
+def _check_ipixels(data, depth):
+    _check_ipixels_npix(data, _NPIX_TABLE[depth])
+
+# Same as `_check_ipixels` given the number of HEALPix cells
+def _check_ipixels_npix(data, npix):
+    if data.size == 0:
+        return
+
+    # Reductions do not allocate boolean temporaries. Seen as unsigned
+    # integers, negative int64 values wrap above npix (which is < 2^63)
+    # so that a single reduction checks both bounds. Unsigned arrays
+    # cannot hold negative values so their lower bound is skipped.
+    if data.dtype == np.int64:
+        data = data.view(np.uint64)
+
+    if data.max() >= npix or (data.dtype.kind != 'u' and data.min() < 0):
+        raise ValueError("The input HEALPix cells contains value out of [0, {0}]".format(npix - 1))
+
+# Return the array the Rust code will write its results into:
+# ``out`` if it is given and matches the expected layout,
+# a new uninitialized array otherwise.
+# With ``transposed``, the array is allocated with its last axis first in
+# memory (i.e. ``a[..., k]`` is contiguous) and ``out`` may be given either
+# in this layout or C-contiguous. It is only used for the Rust kernels
+# that follow the strides of their output arrays.
+def _output_array(out, shape, dtype, transposed=False):
+    if out is None:
+        if transposed:
+            return np.moveaxis(np.empty(shape[-1:] + shape[:-1], dtype=dtype), 0, -1)
+        return np.empty(shape, dtype=dtype)
+
+    if not isinstance(out, np.ndarray) or out.shape != shape or out.dtype != dtype:
+        raise ValueError("The output array must be a {0} numpy array of shape {1}".format(np.dtype(dtype).name, shape))
+
+    contiguous = out.flags['C_CONTIGUOUS'] or \
+        (transposed and np.moveaxis(out, -1, 0).flags['C_CONTIGUOUS'])
+    if not contiguous or not out.flags['WRITEABLE']:
+        if transposed:
+            raise ValueError("The output array must be C-contiguous (or a transposed "
+                             "C-contiguous array with its last axis first) and writeable")
+        raise ValueError("The output array must be C-contiguous and writeable")
+
+    return out
+
+# Contiguous arrays of at least one dimension handed to the Rust code.
+# A single C-level call checks the input and only copies it when its
+# dtype or memory layout does not match.
+def _as_f64(data):
+    return np.ascontiguousarray(data, dtype=np.float64)
+
+def _as_u64(data):
+    return np.ascontiguousarray(data, dtype=np.uint64)
+
+# `np.atleast_1d` returning the common already 1D (or more) numpy array
+# input as is without going through the generic function
+def _atleast_1d(data):
+    if type(data) is np.ndarray and data.ndim >= 1:
+        return data
+    return np.atleast_1d(data)
+
+_DEG2RAD = np.pi / 180.0
+
+# Angle quantities converted to radians and handed to the Rust code.
+# Degrees, the usual unit, are scaled by a single multiplication writing
+# straight into a float64 array instead of going through the astropy unit
+# conversion machinery (and a second pass for non float64 inputs).
+def _as_rad_f64(angle):
+    if angle.unit is u.rad:
+        return _as_f64(angle.value)
+    if angle.unit is u.deg:
+        return _as_f64(np.multiply(angle.value, _DEG2RAD, dtype=np.float64))
+    return _as_f64(angle.to_value(u.rad))
+
+# The ICRS (ra, dec) of a SkyCoord. The frame transformation is done once
+# and skipped when the coordinates are already expressed in ICRS.
+def _icrs_lonlat(skycoord):
+    if skycoord.frame.name != 'icrs':
+        skycoord = skycoord.icrs
+    return skycoord.ra, skycoord.dec
+
+# Build an ICRS SkyCoord from longitudes and latitudes in radians.
+# Giving SkyCoord a ready-made frame skips the parsing of the ra/dec
+# keyword arguments and the copies of the coordinates.
+def _skycoord(lon, lat):
+    representation = UnitSphericalRepresentation(
+        lon=u.Quantity(lon, u.rad, copy=False),
+        lat=u.Quantity(lat, u.rad, copy=False),
+        copy=False
+    )
+    return SkyCoord(ICRS(representation, copy=False), copy=False)
@@ -1,17 +1,42 @@
 from .. import cdshealpix # noqa
+from .._common import _NPIX_TABLE, _check_ipixels, _output_array, _as_f64, _as_u64, _atleast_1d, \
+    _as_rad_f64, _icrs_lonlat, _skycoord
+
+from functools import lru_cache
+import operator
 
 import astropy.units as u
-from astropy.coordinates import SkyCoord, Angle
+from astropy.coordinates import Angle
 import numpy as np
 
-# Raise a ValueError exception if the input 
-# HEALPix cells array contains invalid values
-def _check_ipixels(data, depth):
-    npix = 12 * 4 ** (depth)
-    if (data >= npix).any() or (data < 0).any():
-        raise ValueError("The input HEALPix cells contains value out of [0, {0}]".format(npix - 1))
-
-def lonlat_to_healpix(lon, lat, depth, return_offsets=False):
+__all__ = [
+    'lonlat_to_healpix', 'skycoord_to_healpix',
+    'healpix_to_lonlat', 'healpix_to_skycoord', 'healpix_to_xy',
+    'lonlat_to_xy', 'xy_to_lonlat',
+    'vertices', 'vertices_skycoord', 'neighbours', 'external_neighbours',
+    'cone_search', 'multi_cone_search', 'polygon_search', 'elliptical_cone_search',
+    'bilinear_interpolation',
+]
+
+# Number of cells processed by each call to the Rust code. Larger inputs
+# are cut into blocks of this size so that the arrays of the block being
+# processed stay in the L2 cache.
+_BLOCK_SIZE = 1 << 16
+
+def _blocks(size):
+    for start in range(0, size, _BLOCK_SIZE):
+        yield slice(start, start + _BLOCK_SIZE)
+
+# Single positions are often hashed repeatedly (e.g. when cross-matching
+# catalogs one source at a time). Recently hashed positions are kept so that
+# their cells are returned without calling the Rust code. The exact
+# coordinates are used as key so that a cached result is always
+# the one that would have been computed.
+@lru_cache(maxsize=1024)
+def _lonlat_to_healpix_scalar(depth, lon, lat):
+    return cdshealpix.lonlat_to_healpix_scalar(depth, lon, lat)
+
+def lonlat_to_healpix(lon, lat, depth, return_offsets=False, out=None, raw=False):
     r"""Get the HEALPix indexes that contains specific sky coordinates
 
     The depth of the returned HEALPix cell indexes must be specified. This 
@@ -24,12 +49,22 @@ def lonlat_to_healpix(lon, lat, depth, return_offsets=False):
         The longitudes of the sky coordinates.
     lat : `astropy.units.Quantity`
         The latitudes of the sky coordinates.
-    depth : int
-        The depth of the returned HEALPix cell indexes.
+    depth : int or `numpy.array`
+        The depth of the returned HEALPix cell indexes. If a 1D array of depths is given,
+        the cells are computed at each of these depths in a single call and the returned
+        arrays get an extra first axis running over the depths.
     return_offsets : bool, optional
         If set to `True`, returns a tuple made of 3 elements, the HEALPix cell
         indexes and the dx, dy arrays telling where the (``lon``, ``lat``) coordinates
         passed are located on the cells. ``dx`` and ``dy`` are :math:`\in [0, 1]`
+    out : `numpy.array` or tuple of `numpy.array`, optional
+        Pre-allocated array(s) in which the result is written, i.e. the ``ipix`` array, or the
+        (``ipix``, ``dx``, ``dy``) tuple of arrays if ``return_offsets`` is set to `True`.
+        They must be C-contiguous, have the shape of the returned arrays and respectively be of
+        `np.uint64`, `np.float64` and `np.float64` dtype.
+    raw : bool, optional
+        If set to `True`, ``lon`` and ``lat`` are plain numpy arrays (or floats) given in radians,
+        e.g. the coordinates returned by ``healpix_to_lonlat(..., raw=True)``. `False` by default.
 
     Returns
     -------
@@ -40,6 +75,8 @@ def lonlat_to_healpix(lon, lat, depth, return_offsets=False):
     ------
     ValueError
         When the number of longitudes and latitudes given do not match.
+    ValueError
+        When the arrays given in ``out`` do not match the expected dtype and shape.
 
     Examples
     --------
@@ -51,24 +88,78 @@ def lonlat_to_healpix(lon, lat, depth, return_offsets=False):
     >>> depth = 12
     >>> ipix = lonlat_to_healpix(lon, lat, depth)
     """
+    multi_depth = np.ndim(depth) > 0
+    if multi_depth:
+        depth = np.asarray(depth)
+        if depth.ndim != 1:
+            raise ValueError("Depth must be an int or a 1D array of ints")
+        if (depth < 0).any() or (depth > 29).any():
+            raise ValueError("Depth must be in the [0, 29] closed range")
+        depth = depth.astype(np.uint8)
+    else:
+        # A python int is needed as key of the scalar cache
+        depth = operator.index(depth)
+        if depth < 0 or depth > 29:
+            raise ValueError("Depth must be in the [0, 29] closed range")
+
+    # A single position is hashed without going through the numpy arrays
+    # machinery. The results are still returned as 1-element arrays.
+    if raw:
+        is_scalar = np.ndim(lon) == 0 and np.ndim(lat) == 0
+    else:
+        is_scalar = lon.isscalar and lat.isscalar
+
+    if not multi_depth and out is None and is_scalar:
+        if not raw:
+            lon = lon.to_value(u.rad)
+            lat = lat.to_value(u.rad)
+        ipix, dx, dy = _lonlat_to_healpix_scalar(depth, float(lon), float(lat))
+        ipix = np.array([ipix], dtype=np.uint64)
+        if return_offsets:
+            return ipix, np.array([dx]), np.array([dy])
+        else:
+            return ipix
+
     # Handle the case of an uniq lon, lat tuple given by creating a
     # 1d numpy array from the 0d astropy quantities.
-    lon = np.atleast_1d(lon.to_value(u.rad))
-    lat = np.atleast_1d(lat.to_value(u.rad))
-
-    if depth < 0 or depth > 29:
-        raise ValueError("Depth must be in the [0, 29] closed range")
+    if raw:
+        lon = _as_f64(lon)
+        lat = _as_f64(lat)
+    else:
+        lon = _as_rad_f64(lon)
+        lat = _as_rad_f64(lat)
 
     if lon.shape != lat.shape:
         raise ValueError("The number of longitudes does not match with the number of latitudes given")
 
-    num_ipix = lon.shape
+    if return_offsets:
+        ipix_out, dx_out, dy_out = out if out is not None else (None, None, None)
+    else:
+        ipix_out, dx_out, dy_out = out, None, None
+
+    num_ipix = depth.shape + lon.shape if multi_depth else lon.shape
     # Allocation of the array containing the resulting ipixels
-    ipix = np.empty(num_ipix, dtype=np.uint64)
-    dx = np.empty(num_ipix, dtype=np.float64)
-    dy = np.empty(num_ipix, dtype=np.float64)
+    ipix = _output_array(ipix_out, num_ipix, np.uint64)
 
-    cdshealpix.lonlat_to_healpix(depth, lon, lat, ipix, dx, dy)
+    if not multi_depth and not return_offsets:
+        # Only the cells are computed and written
+        lon_flat, lat_flat, ipix_flat = lon.ravel(), lat.ravel(), ipix.reshape(-1)
+        for block in _blocks(lon_flat.size):
+            cdshealpix.lonlat_to_healpix_ipix(depth, lon_flat[block], lat_flat[block], ipix_flat[block])
+        return ipix
+
+    dx = _output_array(dx_out, num_ipix, np.float64)
+    dy = _output_array(dy_out, num_ipix, np.float64)
+
+    if multi_depth:
+        # The Rust code loops over the depths itself
+        cdshealpix.lonlat_to_healpix_multi_depth(depth, lon, lat, ipix, dx, dy)
+    else:
+        # The output arrays are C-contiguous, reshaping them returns views
+        lon_flat, lat_flat = lon.ravel(), lat.ravel()
+        ipix_flat, dx_flat, dy_flat = ipix.reshape(-1), dx.reshape(-1), dy.reshape(-1)
+        for block in _blocks(lon_flat.size):
+            cdshealpix.lonlat_to_healpix(depth, lon_flat[block], lat_flat[block], ipix_flat[block], dx_flat[block], dy_flat[block])
 
     if return_offsets:
         return ipix, dx, dy
@@ -87,8 +178,9 @@ def skycoord_to_healpix(skycoord, depth, return_offsets=False):
     ----------
     skycoord : `astropy.coordinates.SkyCoord`
         The sky coordinates.
-    depth : int
-        The depth of the returned HEALPix cell indexes.
+    depth : int or `numpy.array`
+        The depth of the returned HEALPix cell indexes. See `lonlat_to_healpix` for
+        the computation at several depths.
     return_offsets : bool, optional
         If set to `True`, returns a tuple made of 3 elements, the HEALPix cell
         indexes and the dx, dy arrays telling where the (``lon``, ``lat``) coordinates
@@ -114,9 +206,10 @@ def skycoord_to_healpix(skycoord, depth, return_offsets=False):
     >>> depth = 12
     >>> ipix = skycoord_to_healpix(skycoord, depth)
     """
-    return lonlat_to_healpix(skycoord.icrs.ra, skycoord.icrs.dec, depth, return_offsets)
+    lon, lat = _icrs_lonlat(skycoord)
+    return lonlat_to_healpix(lon, lat, depth, return_offsets)
 
-def healpix_to_lonlat(ipix, depth, dx=0.5, dy=0.5):
+def healpix_to_lonlat(ipix, depth, dx=0.5, dy=0.5, out=None, check=True, raw=False):
     r"""Get the longitudes and latitudes of the center of some HEALPix cells at a given depth.
 
     This method does the opposite transformation of `lonlat_to_healpix`.
@@ -133,6 +226,16 @@ def healpix_to_lonlat(ipix, depth, dx=0.5, dy=0.5):
         The offset position :math:`\in [0, 1]` along the X axis. By default, `dx=0.5`
     dy : float, optional
         The offset position :math:`\in [0, 1]` along the Y axis. By default, `dy=0.5`
+    out : (`numpy.array`, `numpy.array`), optional
+        Pre-allocated (``lon``, ``lat``) arrays in which the coordinates, in radians, are written.
+        They must be C-contiguous `np.float64` arrays having the shape of ``ipix``.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
+    raw : bool, optional
+        If set to `True`, the coordinates are returned in radians as plain numpy arrays
+        instead of `astropy.units.Quantity`. `False` by default.
 
     Returns
     -------
@@ -143,6 +246,8 @@ def healpix_to_lonlat(ipix, depth, dx=0.5, dy=0.5):
     ------
     ValueError
         When the HEALPix cell indexes given have values out of :math:`[0, 4^{29 - depth}[`.
+    ValueError
+        When the arrays given in ``out`` do not match the expected dtype and shape.
 
     Examples
     --------
@@ -161,20 +266,38 @@ def healpix_to_lonlat(ipix, depth, dx=0.5, dy=0.5):
     if dy < 0 or dy > 1:
         raise ValueError("dy must be between [0, 1]")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, depth=depth)
-    ipix = ipix.astype(np.uint64)
+    # Same fast path as in `lonlat_to_healpix` for a single cell
+    if out is None and np.ndim(ipix) == 0:
+        npix = _NPIX_TABLE[depth]
+        if check and not 0 <= ipix < npix:
+            raise ValueError("The input HEALPix cells contains value out of [0, {0}]".format(npix - 1))
+
+        lon, lat = cdshealpix.healpix_to_lonlat_scalar(depth, int(ipix), dx, dy)
+        if raw:
+            return np.array([lon]), np.array([lat])
+        return u.Quantity([lon], u.rad), u.Quantity([lat], u.rad)
+
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels(data=ipix, depth=depth)
+    ipix = _as_u64(ipix)
+
+    lon_out, lat_out = out if out is not None else (None, None)
 
     size_skycoords = ipix.shape
     # Allocation of the array containing the resulting coordinates
-    lon = np.zeros(size_skycoords)
-    lat = np.zeros(size_skycoords)
+    lon = _output_array(lon_out, size_skycoords, np.float64)
+    lat = _output_array(lat_out, size_skycoords, np.float64)
 
-    cdshealpix.healpix_to_lonlat(depth, ipix, dx, dy, lon, lat)
+    ipix_flat, lon_flat, lat_flat = ipix.reshape(-1), lon.reshape(-1), lat.reshape(-1)
+    for block in _blocks(ipix_flat.size):
+        cdshealpix.healpix_to_lonlat(depth, ipix_flat[block], dx, dy, lon_flat[block], lat_flat[block])
 
-    return lon * u.rad, lat * u.rad
+    if raw:
+        return lon, lat
+    return u.Quantity(lon, u.rad, copy=False), u.Quantity(lat, u.rad, copy=False)
 
-def healpix_to_skycoord(ipix, depth, dx=0.5, dy=0.5):
+def healpix_to_skycoord(ipix, depth, dx=0.5, dy=0.5, check=True):
     r"""Get the sky coordinates of the center of some HEALPix cells at a given depth.
 
     This method does the opposite transformation of `lonlat_to_healpix`.
@@ -193,6 +316,10 @@ def healpix_to_skycoord(ipix, depth, dx=0.5, dy=0.5):
         The offset position :math:`\in [0, 1]` along the X axis. By default, `dx=0.5`
     dy : float, optional
         The offset position :math:`\in [0, 1]` along the Y axis. By default, `dy=0.5`
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -212,10 +339,10 @@ def healpix_to_skycoord(ipix, depth, dx=0.5, dy=0.5):
     >>> depth = 12
     >>> skycoord = healpix_to_skycoord(ipix, depth)
     """
-    lon, lat = healpix_to_lonlat(ipix, depth, dx, dy)
-    return SkyCoord(ra=lon, dec=lat, frame="icrs", unit="rad")
+    lon, lat = healpix_to_lonlat(ipix, depth, dx, dy, check=check, raw=True)
+    return _skycoord(lon, lat)
 
-def vertices(ipix, depth, step=1):
+def vertices(ipix, depth, step=1, out=None, check=True):
     """Get the longitudes and latitudes of the vertices of some HEALPix cells at a given depth.
 
     This method returns the 4 vertices of each cell in `ipix`.
@@ -233,6 +360,13 @@ def vertices(ipix, depth, step=1):
         it will only return the vertices of the cell. 2 means that it will returns the vertices of
         the cell plus one more vertex per edge (the middle of it). More generally, the number
         of vertices returned is ``4 * step``.
+    out : (`numpy.array`, `numpy.array`), optional
+        Pre-allocated (``lon``, ``lat``) arrays in which the vertices, in radians, are written.
+        They must be C-contiguous `np.float64` arrays of shape :math:`N` x :math:`4 * step`.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -244,6 +378,8 @@ def vertices(ipix, depth, step=1):
     ------
     ValueError
         When the HEALPix cell indexes given have values out of :math:`[0, 4^{29 - depth}[`.
+    ValueError
+        When the arrays given in ``out`` do not match the expected dtype and shape.
 
     Examples
     --------
@@ -259,19 +395,22 @@ def vertices(ipix, depth, step=1):
     if step < 1:
         raise ValueError("The number of step must be >= 1")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, depth=depth)
-    ipix = ipix.astype(np.uint64)
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels(data=ipix, depth=depth)
+    ipix = _as_u64(ipix)
     
+    lon_out, lat_out = out if out is not None else (None, None)
+
     # Allocation of the array containing the resulting coordinates
-    lon = np.zeros(ipix.shape + (4 * step,))
-    lat = np.zeros(ipix.shape + (4 * step,))
+    lon = _output_array(lon_out, ipix.shape + (4 * step,), np.float64)
+    lat = _output_array(lat_out, ipix.shape + (4 * step,), np.float64)
     
     cdshealpix.vertices(depth, ipix, step, lon, lat)
 
-    return lon * u.rad, lat * u.rad
+    return u.Quantity(lon, u.rad, copy=False), u.Quantity(lat, u.rad, copy=False)
 
-def vertices_skycoord(ipix, depth, step=1):
+def vertices_skycoord(ipix, depth, step=1, check=True):
     """Get the sky coordinates of the vertices of some HEALPix cells at a given depth.
 
     This method returns the 4 vertices of each cell in `ipix`.
@@ -289,6 +428,10 @@ def vertices_skycoord(ipix, depth, step=1):
         it will only return the vertices of the cell. 2 means that it will returns the vertices of
         the cell plus one more vertex per edge (the middle of it). More generally, the number
         of vertices returned is ``4 * step``.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -309,13 +452,13 @@ def vertices_skycoord(ipix, depth, step=1):
     >>> depth = 12
     >>> vertices = vertices(ipix, depth)
     """
-    lon, lat = vertices(ipix, depth, step)
-    return SkyCoord(ra=lon, dec=lat, frame="icrs", unit="rad")
+    lon, lat = vertices(ipix, depth, step, check=check)
+    return _skycoord(lon, lat)
 
-def neighbours(ipix, depth):
+def neighbours(ipix, depth, out=None, check=True):
     """Get the neighbouring cells of some HEALPix cells at a given depth.
 
-    This method returns a :math:`N` x :math:`9` `np.uint64` numpy array containing the neighbours of each cell of the :math:`N` sized `ipix` array.
+    This method returns a :math:`N` x :math:`9` `np.int64` numpy array containing the neighbours of each cell of the :math:`N` sized `ipix` array.
     This method is wrapped around the `neighbours <https://docs.rs/cdshealpix/0.1.5/cdshealpix/nested/struct.Layer.html#method.neighbours>`__
     method from the `cdshealpix Rust crate <https://crates.io/crates/cdshealpix>`__.
 
@@ -325,6 +468,14 @@ def neighbours(ipix, depth):
         The HEALPix cell indexes given as a `np.uint64` numpy array.
     depth : int
         The depth of the HEALPix cells.
+    out : `numpy.array`, optional
+        Pre-allocated :math:`N` x :math:`9` `np.int64` array in which the neighbours are written.
+        It must either be C-contiguous or be stored direction by direction, i.e. the transpose of
+        a C-contiguous :math:`9` x :math:`N` array as returned when ``out`` is not given.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -332,11 +483,15 @@ def neighbours(ipix, depth):
         A :math:`N` x :math:`9` `np.int64` numpy array containing the neighbours of each cell.
         The :math:`5^{th}` element corresponds to the index of HEALPix cell from which the neighbours are evaluated.
         All its 8 neighbours occup the remaining elements of the line.
+        Unless ``out`` is given, the array is stored direction by direction (i.e. it is a transposed view
+        of a C-contiguous :math:`9` x :math:`N` array) so that each column is contiguous in memory.
 
     Raises
     ------
     ValueError
         When the HEALPix cell indexes given have values out of :math:`[0, 4^{29 - depth}[`.
+    ValueError
+        When the array given in ``out`` does not match the expected dtype and shape.
 
     Examples
     --------
@@ -349,17 +504,29 @@ def neighbours(ipix, depth):
     if depth < 0 or depth > 29:
         raise ValueError("Depth must be in the [0, 29] closed range")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, depth=depth)
-    ipix = ipix.astype(np.uint64)
+    # Same fast path as in `lonlat_to_healpix` for a single cell
+    if out is None and np.ndim(ipix) == 0:
+        npix = _NPIX_TABLE[depth]
+        if check and not 0 <= ipix < npix:
+            raise ValueError("The input HEALPix cells contains value out of [0, {0}]".format(npix - 1))
+
+        return np.array([cdshealpix.neighbours_scalar(depth, int(ipix))], dtype=np.int64)
+
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels(data=ipix, depth=depth)
+    ipix = _as_u64(ipix)
     
-    # Allocation of the array containing the neighbours
-    neighbours = np.zeros(ipix.shape + (9,), dtype=np.int64)
+    # Allocation of the array containing the neighbours. The neighbours in
+    # a given direction are contiguous so that reading one of them for all the
+    # cells (e.g. ``neighbours[:, 8]`` for the northern ones) does not stride
+    # over the 8 others.
+    neighbours = _output_array(out, ipix.shape + (9,), np.int64, transposed=True)
     cdshealpix.neighbours(depth, ipix, neighbours)
 
     return neighbours
 
-def external_neighbours(ipix, depth, delta_depth):
+def external_neighbours(ipix, depth, delta_depth, check=True):
     """
     Get the neighbours of specific healpix cells
 
@@ -377,6 +544,10 @@ def external_neighbours(ipix, depth, delta_depth):
         The depth of the input healpix cells
     delta_depth : int
         The depth of the returned external neighbours will be equal to: `depth` + `delta_depth`
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -389,18 +560,13 @@ def external_neighbours(ipix, depth, delta_depth):
     if depth < 0 or depth > 29:
         raise ValueError("Depth must be in the [0, 29] closed range")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, depth=depth)
-    ipix = ipix.astype(np.uint64)
-
-    # Allocation of the array containing the neighbours
-    num_external_cells_on_edges = 4 << delta_depth
-    edge_cells = np.zeros(ipix.shape + (num_external_cells_on_edges,), dtype=np.uint64)
-    corner_cells = np.zeros(ipix.shape + (4,), dtype=np.int64)
-
-    cdshealpix.external_neighbours(depth, delta_depth, ipix, corner_cells, edge_cells)
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels(data=ipix, depth=depth)
+    ipix = _as_u64(ipix)
 
-    return edge_cells, corner_cells
+    # The resulting arrays are allocated by the Rust code
+    return cdshealpix.external_neighbours(depth, delta_depth, ipix)
 
 def cone_search(lon, lat, radius, depth, depth_delta=2, flat=False):
     """Get the HEALPix cells contained in a cone at a given depth.
@@ -458,6 +624,70 @@ def cone_search(lon, lat, radius, depth, depth_delta=2, flat=False):
     ipix, depth, full = cdshealpix.cone_search(depth, depth_delta, lon, lat, radius, flat)
     return ipix, depth, full
 
+def multi_cone_search(lon, lat, radius, depth, depth_delta=2, flat=False):
+    """Get the HEALPix cells contained in several cones at a given depth.
+
+    This method is the equivalent of `cone_search` for many cones. The cones are processed
+    in parallel in a single call, which avoids paying the cost of one `cone_search` call per cone.
+    The cells of all the cones are returned in contiguous arrays along with the
+    offsets of the cells of each cone.
+
+    Parameters
+    ----------
+    lon : `astropy.units.Quantity`
+        Longitudes of the centers of the cones.
+    lat : `astropy.units.Quantity`
+        Latitudes of the centers of the cones.
+    radius : `astropy.units.Quantity`
+        Radii of the cones. A scalar radius is used for all the cones.
+    depth : int
+        Maximum depth of the HEALPix cells that will be returned.
+    depth_delta : int, optional
+        To control the approximation, you can choose to perform the computations at a deeper depth using the `depth_delta` parameter.
+        The depth at which the computations will be made will therefore be equal to `depth` + `depth_delta`.
+    flat : boolean, optional
+        False by default (i.e. returns a consistent MOC per cone). If True, the HEALPix cells returned will all be at depth indicated by `depth`.
+
+    Returns
+    -------
+    offsets, ipix, depth, fully_covered : (`numpy.array`, `numpy.array`, `numpy.array`, `numpy.array`)
+        A tuple containing 4 numpy arrays:
+
+        * `offsets` is of size :math:`N + 1` for :math:`N` cones. The cells of the :math:`i^{th}` cone
+          are stored from the index ``offsets[i]`` to ``offsets[i + 1]`` (excluded) of the 3 following arrays.
+        * `ipix` stores HEALPix cell indices.
+        * `depth` stores HEALPix cell depths.
+        * `fully_covered` stores flags on whether the HEALPix cells are fully covered by their cone.
+
+    Raises
+    ------
+    ValueError
+        When the number of longitudes, latitudes and radii given do not match.
+
+    Examples
+    --------
+    >>> from cdshealpix import multi_cone_search
+    >>> import astropy.units as u
+    >>> offsets, ipix, depth, fully_covered = multi_cone_search(lon=[0, 10] * u.deg, lat=[0, 20] * u.deg, radius=1 * u.deg, depth=10)
+    >>> first_cone_ipix = ipix[offsets[0]:offsets[1]]
+    """
+    if depth < 0 or depth > 29:
+        raise ValueError("Depth must be in the [0, 29] closed range")
+
+    lon = _as_rad_f64(lon)
+    lat = _as_rad_f64(lat)
+
+    if lon.shape != lat.shape:
+        raise ValueError("The number of longitudes does not match with the number of latitudes given")
+
+    radius = radius.to_value(u.rad)
+    if np.ndim(radius) > 0 and np.shape(radius) != lon.shape:
+        raise ValueError("The number of radii does not match with the number of cones given")
+    radius = _as_f64(np.broadcast_to(radius, lon.shape))
+
+    offsets, ipix, depth, full = cdshealpix.multi_cone_search(depth, depth_delta, lon, lat, radius, flat)
+    return offsets, ipix, depth, full
+
 def polygon_search(lon, lat, depth, flat=False):
     """Get the HEALPix cells contained in a polygon at a given depth.
 
@@ -504,8 +734,8 @@ def polygon_search(lon, lat, depth, flat=False):
     if depth < 0 or depth > 29:
         raise ValueError("Depth must be in the [0, 29] closed range")
 
-    lon = np.atleast_1d(lon.to_value(u.rad)).ravel()
-    lat = np.atleast_1d(lat.to_value(u.rad)).ravel()
+    lon = _as_rad_f64(lon).ravel()
+    lat = _as_rad_f64(lat).ravel()
 
     if lon.shape != lat.shape:
         raise ValueError("The number of longitudes does not match with the number of latitudes given")
@@ -516,9 +746,10 @@ def polygon_search(lon, lat, depth, flat=False):
         raise IndexError("There must be at least 3 vertices in order to form a polygon")
 
     # Check that there is at least 3 distinct vertices.
-    vertices = np.vstack((lon, lat)).T
-    distinct_vertices = np.unique(vertices, axis=0)
-    if distinct_vertices.shape[0] < 3:
+    # Polygons have few vertices, a set of python floats is much cheaper
+    # to build than the sorted (N, 2) array np.unique(axis=0) works on.
+    distinct_vertices = set(zip(lon.tolist(), lat.tolist()))
+    if len(distinct_vertices) < 3:
         raise IndexError("There must be at least 3 distinct vertices in order to form a polygon")
 
     ipix, depth, full = cdshealpix.polygon_search(depth, lon, lat, flat)
@@ -614,7 +845,7 @@ def elliptical_cone_search(lon, lat, a, b, pa, depth, delta_depth=2, flat=False)
 
     return ipix, depth, full
 
-def healpix_to_xy(ipix, depth):
+def healpix_to_xy(ipix, depth, check=True):
     r"""
     Project the center of a HEALPix cell to the xy-HEALPix plane
 
@@ -624,6 +855,10 @@ def healpix_to_xy(ipix, depth):
         The HEALPix cells which centers will be projected
     depth : int
         The depth of the HEALPix cells
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -643,9 +878,10 @@ def healpix_to_xy(ipix, depth):
     if depth < 0 or depth > 29:
         raise ValueError("Depth must be in the [0, 29] closed range")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, depth=depth)
-    ipix = ipix.astype(np.uint64)
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels(data=ipix, depth=depth)
+    ipix = _as_u64(ipix)
 
     x = np.zeros(ipix.shape, dtype=np.float64)
     y = np.zeros(ipix.shape, dtype=np.float64)
@@ -679,8 +915,8 @@ def lonlat_to_xy(lon, lat):
     >>> lat = [5, 10] * u.deg
     >>> x, y = lonlat_to_xy(lon, lat)
     """
-    lon = np.atleast_1d(lon.to_value(u.rad))
-    lat = np.atleast_1d(lat.to_value(u.rad))
+    lon = _as_rad_f64(lon)
+    lat = _as_rad_f64(lat)
 
     if lon.shape != lat.shape:
         raise ValueError("The number of longitudes does not match with the number of latitudes given")
@@ -718,8 +954,9 @@ def xy_to_lonlat(x, y):
     >>> y = np.array([0.5, 0.5])
     >>> lon, lat = xy_to_lonlat(x, y)
     """
-    x = np.atleast_1d(x.astype(np.float64))
-    y = np.atleast_1d(y.astype(np.float64))
+    # No copy is made if the caller already gives float64 contiguous arrays
+    x = _as_f64(x)
+    y = _as_f64(y)
 
     if x.shape != y.shape:
         raise ValueError("X and Y shapes do not match")
@@ -737,7 +974,7 @@ def xy_to_lonlat(x, y):
     lat = np.empty(num_coords, dtype=np.float64)
 
     cdshealpix.xy_to_lonlat(x, y, lon, lat)
-    return lon * u.rad, lat * u.rad
+    return u.Quantity(lon, u.rad, copy=False), u.Quantity(lat, u.rad, copy=False)
 
 def bilinear_interpolation(lon, lat, depth):
     r"""
@@ -783,8 +1020,8 @@ def bilinear_interpolation(lon, lat, depth):
     >>> depth = 5
     >>> ipix, weights = bilinear_interpolation(lon, lat, depth)
     """
-    lon = np.atleast_1d(lon.to_value(u.rad))
-    lat = np.atleast_1d(lat.to_value(u.rad))
+    lon = _as_rad_f64(lon)
+    lat = _as_rad_f64(lat)
 
     if depth < 0 or depth > 29:
         raise ValueError("Depth must be in the [0, 29] closed range")
@@ -792,10 +1029,5 @@ def bilinear_interpolation(lon, lat, depth):
     if lon.shape != lat.shape:
         raise ValueError("The number of longitudes does not match with the number of latitudes given")
 
-    num_coords = lon.shape
-
-    ipix = np.empty(num_coords + (4,), dtype=np.uint64)
-    weights = np.empty(num_coords + (4,), dtype=np.float64)
-
-    cdshealpix.bilinear_interpolation(depth, lon, lat, ipix, weights)
-    return ipix, weights
\ No newline at end of file
+    # The resulting arrays are allocated by the Rust code
+    return cdshealpix.bilinear_interpolation(depth, lon, lat)
\ No newline at end of file
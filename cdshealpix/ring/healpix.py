@@ -1,18 +1,34 @@
 from .. import cdshealpix # noqa
+from functools import lru_cache
+import operator
+from .._common import _as_u64, _as_f64, _as_rad_f64, _output_array, _icrs_lonlat, _atleast_1d, \
+    _check_ipixels_npix, _skycoord
 
 import astropy.units as u
-from astropy.coordinates import SkyCoord, Angle
 import numpy as np
 
-# Raise a ValueError exception if the input 
-# HEALPix cells array contains invalid values
-def _check_ipixels(data, nside):
-    npix = 12 * (nside ** 2)
-    if (data >= npix).any() or (data < 0).any():
-        raise ValueError("The input HEALPix cells contains value out of [0, {0}]".format(npix - 1))
+__all__ = [
+    'lonlat_to_healpix', 'skycoord_to_healpix',
+    'healpix_to_lonlat', 'healpix_to_skycoord', 'healpix_to_xy',
+    'vertices', 'vertices_skycoord',
+]
+
+# Raise a ValueError exception if nside is not valid, returns the number of
+# HEALPix cells at this nside otherwise. Calls usually share a few nsides
+# so that the result is cached. ``nside`` must be given as a python int
+# (e.g. a 0-d numpy array is not hashable).
+@lru_cache(maxsize=64)
+def _validate_nside(nside):
+    if nside < 1 or nside > (1 << 29):
+        raise ValueError("nside must be in the [1, (1 << 29)[ closed range")
+    return 12 * nside * nside
 
+# Same as `_check_ipixels_npix` for a single HEALPix cell
+def _check_ipix(ipix, npix):
+    if not 0 <= ipix < npix:
+        raise ValueError("The input HEALPix cells contains value out of [0, {0}]".format(npix - 1))
 
-def lonlat_to_healpix(lon, lat, nside, return_offsets=False):
+def lonlat_to_healpix(lon, lat, nside, return_offsets=False, out=None, raw=False):
     r"""Get the HEALPix indexes that contains specific sky coordinates
 
     The ``nside`` of the returned HEALPix cell indexes must be specified. This 
@@ -31,6 +47,14 @@ def lonlat_to_healpix(lon, lat, nside, return_offsets=False):
         If set to `True`, returns a tuple made of 3 elements, the HEALPix cell
         indexes and the dx, dy arrays telling where the (``lon``, ``lat``) coordinates
         passed are located on the cells. ``dx`` and ``dy`` are :math:`\in [0, 1]`
+    out : `numpy.array` or tuple of `numpy.array`, optional
+        Pre-allocated array(s) in which the result is written, i.e. the ``ipix`` array, or the
+        (``ipix``, ``dx``, ``dy``) tuple of arrays if ``return_offsets`` is set to `True`.
+        They must be C-contiguous, have the shape of ``lon`` and respectively be of
+        `np.uint64`, `np.float64` and `np.float64` dtype.
+    raw : bool, optional
+        If set to `True`, ``lon`` and ``lat`` are plain numpy arrays (or floats) given in radians,
+        e.g. the coordinates returned by ``healpix_to_lonlat(..., raw=True)``. `False` by default.
 
     Returns
     -------
@@ -41,6 +65,8 @@ def lonlat_to_healpix(lon, lat, nside, return_offsets=False):
     ------
     ValueError
         When the number of longitudes and latitudes given do not match.
+    ValueError
+        When the arrays given in ``out`` do not match the expected dtype and shape.
 
     Examples
     --------
@@ -52,29 +78,55 @@ def lonlat_to_healpix(lon, lat, nside, return_offsets=False):
     >>> depth = 12
     >>> ipix = lonlat_to_healpix(lon, lat, (1 << depth))
     """
+    nside = operator.index(nside)
+    _validate_nside(nside)
+
+    # A single position is hashed without going through the numpy arrays
+    # machinery. The results are still returned as 1-element arrays.
+    if raw:
+        is_scalar = np.ndim(lon) == 0 and np.ndim(lat) == 0
+    else:
+        is_scalar = lon.isscalar and lat.isscalar
+
+    if out is None and is_scalar:
+        if not raw:
+            lon = lon.to_value(u.rad)
+            lat = lat.to_value(u.rad)
+        ipix, dx, dy = cdshealpix.lonlat_to_healpix_ring_scalar(nside, float(lon), float(lat))
+        ipix = np.array([ipix], dtype=np.uint64)
+        if return_offsets:
+            return ipix, np.array([dx]), np.array([dy])
+        else:
+            return ipix
+
     # Handle the case of an uniq lon, lat tuple given by creating a
     # 1d numpy array from the 0d astropy quantities.
-    lon = np.atleast_1d(lon.to_value(u.rad))
-    lat = np.atleast_1d(lat.to_value(u.rad))
-
-    if nside < 1 or nside > (1 << 29):
-        raise ValueError("nside must be in the [1, (1 << 29)[ closed range")
+    if raw:
+        lon = _as_f64(lon)
+        lat = _as_f64(lat)
+    else:
+        lon = _as_rad_f64(lon)
+        lat = _as_rad_f64(lat)
 
     if lon.shape != lat.shape:
         raise ValueError("The number of longitudes does not match with the number of latitudes given")
 
     num_ipix = lon.shape
+    if not return_offsets:
+        # Only the cells are computed and written, the Rust code
+        # then streams into a single output array.
+        ipix = _output_array(out, num_ipix, np.uint64)
+        cdshealpix.lonlat_to_healpix_ring_ipix(nside, lon, lat, ipix)
+        return ipix
+
+    ipix_out, dx_out, dy_out = out if out is not None else (None, None, None)
     # Allocation of the array containing the resulting ipixels
-    ipix = np.empty(num_ipix, dtype=np.uint64)
-    dx = np.empty(num_ipix, dtype=np.float64)
-    dy = np.empty(num_ipix, dtype=np.float64)
+    ipix = _output_array(ipix_out, num_ipix, np.uint64)
+    dx = _output_array(dx_out, num_ipix, np.float64)
+    dy = _output_array(dy_out, num_ipix, np.float64)
 
     cdshealpix.lonlat_to_healpix_ring(nside, lon, lat, ipix, dx, dy)
-
-    if return_offsets:
-        return ipix, dx, dy
-    else:
-        return ipix
+    return ipix, dx, dy
 
 def skycoord_to_healpix(skycoord, nside, return_offsets=False):
     r"""Get the HEALPix indexes that contains specific sky coordinates
@@ -115,9 +167,10 @@ def skycoord_to_healpix(skycoord, nside, return_offsets=False):
     >>> depth = 12
     >>> ipix = skycoord_to_healpix(skycoord, 1 << depth)
     """
-    return lonlat_to_healpix(skycoord.icrs.ra, skycoord.icrs.dec, nside, return_offsets)
+    lon, lat = _icrs_lonlat(skycoord)
+    return lonlat_to_healpix(lon, lat, nside, return_offsets)
 
-def healpix_to_lonlat(ipix, nside, dx=0.5, dy=0.5):
+def healpix_to_lonlat(ipix, nside, dx=0.5, dy=0.5, out=None, check=True, raw=False):
     r"""Get the longitudes and latitudes of the center of some HEALPix cells at a given depth.
 
     This method does the opposite transformation of `lonlat_to_healpix`.
@@ -134,6 +187,16 @@ def healpix_to_lonlat(ipix, nside, dx=0.5, dy=0.5):
         The offset position :math:`\in [0, 1]` along the X axis. By default, `dx=0.5`
     dy : float, optional
         The offset position :math:`\in [0, 1]` along the Y axis. By default, `dy=0.5`
+    out : (`numpy.array`, `numpy.array`), optional
+        Pre-allocated (``lon``, ``lat``) arrays in which the coordinates, in radians, are written.
+        They must be C-contiguous `np.float64` arrays having the shape of ``ipix``.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
+    raw : bool, optional
+        If set to `True`, the coordinates are returned in radians as plain numpy arrays
+        instead of `astropy.units.Quantity`. `False` by default.
 
     Returns
     -------
@@ -144,6 +207,8 @@ def healpix_to_lonlat(ipix, nside, dx=0.5, dy=0.5):
     ------
     ValueError
         When the HEALPix cell indexes given have values out of :math:`[0, 12` x :math:`N_{side} ^ 2[`.
+    ValueError
+        When the arrays given in ``out`` do not match the expected dtype and shape.
 
     Examples
     --------
@@ -153,8 +218,8 @@ def healpix_to_lonlat(ipix, nside, dx=0.5, dy=0.5):
     >>> depth = 12
     >>> lon, lat = healpix_to_lonlat(ipix, 1 << depth)
     """
-    if nside < 1 or nside > (1 << 29):
-        raise ValueError("nside must be in the [1, (1 << 29)[ closed range")
+    nside = operator.index(nside)
+    npix = _validate_nside(nside)
 
     if dx < 0 or dx > 1:
         raise ValueError("dx must be between [0, 1]")
@@ -162,19 +227,34 @@ def healpix_to_lonlat(ipix, nside, dx=0.5, dy=0.5):
     if dy < 0 or dy > 1:
         raise ValueError("dy must be between [0, 1]")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, nside=nside)
-    ipix = ipix.astype(np.uint64)
+    # Same fast path as in `lonlat_to_healpix` for a single cell
+    if out is None and np.ndim(ipix) == 0:
+        if check:
+            _check_ipix(ipix, npix)
+        lon, lat = cdshealpix.healpix_to_lonlat_ring_scalar(nside, int(ipix), dx, dy)
+        if raw:
+            return np.array([lon]), np.array([lat])
+        return u.Quantity([lon], u.rad), u.Quantity([lat], u.rad)
+
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels_npix(data=ipix, npix=npix)
+    ipix = _as_u64(ipix)
+
+    lon_out, lat_out = out if out is not None else (None, None)
 
     size_skycoords = ipix.shape
     # Allocation of the array containing the resulting coordinates
-    lon = np.zeros(size_skycoords)
-    lat = np.zeros(size_skycoords)
+    lon = _output_array(lon_out, size_skycoords, np.float64)
+    lat = _output_array(lat_out, size_skycoords, np.float64)
 
     cdshealpix.healpix_to_lonlat_ring(nside, ipix, dx, dy, lon, lat)
-    return lon * u.rad, lat * u.rad
 
-def healpix_to_skycoord(ipix, nside, dx=0.5, dy=0.5):
+    if raw:
+        return lon, lat
+    return u.Quantity(lon, u.rad, copy=False), u.Quantity(lat, u.rad, copy=False)
+
+def healpix_to_skycoord(ipix, nside, dx=0.5, dy=0.5, check=True):
     r"""Get the sky coordinates of the center of some HEALPix cells at a given nside.
 
     This method does the opposite transformation of `lonlat_to_healpix`.
@@ -193,6 +273,10 @@ def healpix_to_skycoord(ipix, nside, dx=0.5, dy=0.5):
         The offset position :math:`\in [0, 1]` along the X axis. By default, `dx=0.5`
     dy : float, optional
         The offset position :math:`\in [0, 1]` along the Y axis. By default, `dy=0.5`
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -212,10 +296,10 @@ def healpix_to_skycoord(ipix, nside, dx=0.5, dy=0.5):
     >>> depth = 12
     >>> skycoord = healpix_to_skycoord(ipix, 1 << depth)
     """
-    lon, lat = healpix_to_lonlat(ipix, nside, dx, dy)
-    return SkyCoord(ra=lon, dec=lat, frame="icrs", unit="rad")
+    lon, lat = healpix_to_lonlat(ipix, nside, dx, dy, check=check, raw=True)
+    return _skycoord(lon, lat)
 
-def healpix_to_xy(ipix, nside):
+def healpix_to_xy(ipix, nside, out=None, check=True):
     r"""
     Project the center of a HEALPix cell to the xy-HEALPix plane
 
@@ -225,6 +309,13 @@ def healpix_to_xy(ipix, nside):
         The HEALPix cells which centers will be projected
     nside : int
         The nside of the HEALPix cells
+    out : (`numpy.array`, `numpy.array`), optional
+        Pre-allocated (``x``, ``y``) arrays in which the projected positions are written.
+        They must be C-contiguous `np.float64` arrays having the shape of ``ipix``.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -232,6 +323,13 @@ def healpix_to_xy(ipix, nside):
         The position of the HEALPix centers in the xy-HEALPix plane.
         :math:`x \in [0, 8[` and :math:`y \in [-2, 2]`
 
+    Raises
+    ------
+    ValueError
+        When the HEALPix cell indexes given have values out of :math:`[0, 12` x :math:`N_{side} ^ 2[`.
+    ValueError
+        When the arrays given in ``out`` do not match the expected dtype and shape.
+
     Examples
     --------
     >>> from cdshealpix.ring import healpix_to_xy
@@ -241,20 +339,28 @@ def healpix_to_xy(ipix, nside):
     >>> ipix = np.arange(12)
     >>> x, y = healpix_to_xy(ipix, 1 << depth)
     """
-    if nside < 1 or nside > (1 << 29):
-        raise ValueError("nside must be in the [1, (1 << 29)[ closed range")
-
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, nside=nside)
-    ipix = ipix.astype(np.uint64)
-
-    x = np.zeros(ipix.shape, dtype=np.float64)
-    y = np.zeros(ipix.shape, dtype=np.float64)
+    nside = operator.index(nside)
+    npix = _validate_nside(nside)
+
+    if out is None and np.ndim(ipix) == 0:
+        if check:
+            _check_ipix(ipix, npix)
+        x, y = cdshealpix.healpix_to_xy_ring_scalar(nside, int(ipix))
+        return np.array([x]), np.array([y])
+
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels_npix(data=ipix, npix=npix)
+    ipix = _as_u64(ipix)
+
+    x_out, y_out = out if out is not None else (None, None)
+    x = _output_array(x_out, ipix.shape, np.float64)
+    y = _output_array(y_out, ipix.shape, np.float64)
     cdshealpix.healpix_to_xy_ring(nside, ipix, x, y)
 
     return x, y
 
-def vertices(ipix, nside, step=1):
+def vertices(ipix, nside, step=1, out=None, check=True):
     """Get the longitudes and latitudes of the vertices of some HEALPix cells at a given nside.
 
     This method returns the 4 vertices of each cell in `ipix`.
@@ -272,12 +378,23 @@ def vertices(ipix, nside, step=1):
         it will only return the vertices of the cell. 2 means that it will returns the vertices of
         the cell plus one more vertex per edge (the middle of it). More generally, the number
         of vertices returned is ``4 * step``.
+    out : (`numpy.array`, `numpy.array`), optional
+        Pre-allocated (``lon``, ``lat``) arrays in which the vertices, in radians, are written.
+        They must be `np.float64` arrays of shape :math:`N` x :math:`4 * step`, either C-contiguous or
+        stored vertex by vertex, i.e. the transpose of C-contiguous :math:`4 * step` x :math:`N` arrays
+        as returned when ``out`` is not given.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
     lon, lat : (`astropy.units.Quantity`, `astropy.units.Quantity`)
         The sky coordinates of the 4 vertices of the HEALPix cells. `lon` and `lat` are each `~astropy.units.Quantity` instances
         containing a :math:`N` x :math:`4` numpy array where N is the number of HEALPix cell given in `ipix`.
+        Unless ``out`` is given, the arrays are stored vertex by vertex (i.e. they are transposed views
+        of C-contiguous :math:`4` x :math:`N` arrays).
 
     Warnings
     --------
@@ -287,6 +404,8 @@ def vertices(ipix, nside, step=1):
     ------
     ValueError
         When the HEALPix cell indexes given have values out of :math:`[0, 12` x :math:`N_{side} ^ 2[`.
+    ValueError
+        When the arrays given in ``out`` do not match the expected dtype and shape.
 
     Examples
     --------
@@ -296,24 +415,34 @@ def vertices(ipix, nside, step=1):
     >>> depth = 12
     >>> lon, lat = vertices(ipix, (1 << depth))
     """
-    if nside < 1 or nside > (1 << 29):
-        raise ValueError("nside must be in the [1, (1 << 29)[ closed range")
+    nside = operator.index(nside)
+    npix = _validate_nside(nside)
 
     if step < 1:
         raise ValueError("The number of step must be >= 1")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, nside=nside)
-    ipix = ipix.astype(np.uint64)
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels_npix(data=ipix, npix=npix)
+    ipix = _as_u64(ipix)
 
-    # Allocation of the array containing the resulting coordinates
-    lon = np.zeros(ipix.shape + (4 * step,))
-    lat = np.zeros(ipix.shape + (4 * step,))
+    lon_out, lat_out = out if out is not None else (None, None)
+
+    # Allocation of the array containing the resulting coordinates. The k-th
+    # vertices of all the cells are contiguous: the Rust code then writes
+    # 4 sequential streams and ``lon[:, k]`` does not stride over the others.
+    lon = _output_array(lon_out, ipix.shape + (4 * step,), np.float64, transposed=True)
+    lat = _output_array(lat_out, ipix.shape + (4 * step,), np.float64, transposed=True)
+    if step > 1:
+        # The Rust code only writes the 4 vertices of the cells (``step`` is
+        # not implemented yet) so the remaining values are zeroed.
+        lon[..., 4:] = 0
+        lat[..., 4:] = 0
 
     cdshealpix.vertices_ring(nside, ipix, step, lon, lat)
-    return lon * u.rad, lat * u.rad
+    return u.Quantity(lon, u.rad, copy=False), u.Quantity(lat, u.rad, copy=False)
 
-def vertices_skycoord(ipix, nside, step=1):
+def vertices_skycoord(ipix, nside, step=1, check=True):
     """Get the sky coordinates of the vertices of some HEALPix cells at a given nside.
 
     This method returns the 4 vertices of each cell in `ipix`.
@@ -331,6 +460,10 @@ def vertices_skycoord(ipix, nside, step=1):
         it will only return the vertices of the cell. 2 means that it will returns the vertices of
         the cell plus one more vertex per edge (the middle of it). More generally, the number
         of vertices returned is ``4 * step``.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -351,5 +484,5 @@ def vertices_skycoord(ipix, nside, step=1):
     >>> depth = 12
     >>> vertices = vertices_skycoord(ipix, 1 << depth)
     """
-    lon, lat = vertices(ipix, nside, step)
-    return SkyCoord(ra=lon, dec=lat, frame="icrs", unit="rad")
\ No newline at end of file
+    lon, lat = vertices(ipix, nside, step, check=check)
+    return _skycoord(lon, lat)
\ No newline at end of file
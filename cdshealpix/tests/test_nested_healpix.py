@@ -14,6 +14,7 @@ from ..nested import lonlat_to_healpix, \
  vertices, \
  neighbours, \
  cone_search, \
+ multi_cone_search, \
  polygon_search, \
  elliptical_cone_search, \
  external_neighbours, \
@@ -47,6 +48,142 @@ def test_healpix_to_lonlat(size):
     lon, lat = healpix_to_lonlat(ipix=ipixels, depth=depth)
     assert(lon.shape == lat.shape)
 
+def test_healpix_vs_lonlat_raw():
+    depth = 12
+    ipixels = np.random.randint(12 * 4 ** depth, size=1000, dtype="uint64")
+
+    lon, lat = healpix_to_lonlat(ipixels, depth, raw=True)
+    assert type(lon) is np.ndarray and type(lat) is np.ndarray
+    expected_lon, expected_lat = healpix_to_lonlat(ipixels, depth)
+    assert (lon == expected_lon.to_value(u.rad)).all()
+    assert (lat == expected_lat.to_value(u.rad)).all()
+
+    assert (lonlat_to_healpix(lon, lat, depth, raw=True) == ipixels).all()
+    assert (lonlat_to_healpix(lon[0], lat[0], depth, raw=True) == ipixels[:1]).all()
+
+def test_skycoord_to_healpix_frame():
+    depth = 12
+    skycoord = SkyCoord(np.random.rand(100) * 360 * u.deg, (np.random.rand(100) * 178 - 89) * u.deg, frame="galactic")
+
+    expected_ipix = lonlat_to_healpix(skycoord.icrs.ra, skycoord.icrs.dec, depth)
+    assert (skycoord_to_healpix(skycoord, depth) == expected_ipix).all()
+    assert (skycoord_to_healpix(skycoord.icrs, depth) == expected_ipix).all()
+
+def test_lonlat_to_healpix_out():
+    depth = 12
+    size = 1000
+    lon = np.random.rand(size) * 360 * u.deg
+    lat = (np.random.rand(size) * 178 - 89) * u.deg
+
+    ipix = np.empty(size, dtype=np.uint64)
+    dx = np.empty(size, dtype=np.float64)
+    dy = np.empty(size, dtype=np.float64)
+    result = lonlat_to_healpix(lon, lat, depth, return_offsets=True, out=(ipix, dx, dy))
+
+    assert result[0] is ipix
+    assert (ipix == lonlat_to_healpix(lon, lat, depth)).all()
+
+    with pytest.raises(ValueError):
+        lonlat_to_healpix(lon, lat, depth, out=np.empty(size, dtype=np.int64))
+    with pytest.raises(ValueError):
+        lonlat_to_healpix(lon, lat, depth, out=np.empty(size + 1, dtype=np.uint64))
+
+def test_healpix_to_lonlat_out():
+    depth = 12
+    size = 1000
+    ipixels = np.random.randint(12 * 4 ** depth, size=size, dtype="uint64")
+
+    lon = np.empty(size, dtype=np.float64)
+    lat = np.empty(size, dtype=np.float64)
+    healpix_to_lonlat(ipixels, depth, out=(lon, lat))
+    expected_lon, expected_lat = healpix_to_lonlat(ipixels, depth)
+    assert (lon == expected_lon.to_value(u.rad)).all()
+    assert (lat == expected_lat.to_value(u.rad)).all()
+
+    lon = np.empty((size, 4), dtype=np.float64)
+    lat = np.empty((size, 4), dtype=np.float64)
+    vertices(ipixels, depth, out=(lon, lat))
+    expected_lon, expected_lat = vertices(ipixels, depth)
+    assert (lon == expected_lon.to_value(u.rad)).all()
+    assert (lat == expected_lat.to_value(u.rad)).all()
+
+    neigh = np.empty((size, 9), dtype=np.int64)
+    neighbours(ipixels, depth, out=neigh)
+    assert (neigh == neighbours(ipixels, depth)).all()
+
+    with pytest.raises(ValueError):
+        healpix_to_lonlat(ipixels, depth, out=(lon, lat))
+
+@pytest.mark.parametrize("unit", [u.deg, u.rad, u.arcmin])
+def test_lonlat_to_healpix_f32(unit):
+    depth = 12
+    # float32 angles are converted to radians in float64
+    lon = (np.random.rand(100) * 0.5).astype(np.float32) * unit
+    lat = (np.random.rand(100) * 0.5).astype(np.float32) * unit
+
+    ipix, dx, dy = lonlat_to_healpix(lon, lat, depth, return_offsets=True)
+    expected_ipix, expected_dx, expected_dy = lonlat_to_healpix(
+        u.Quantity(lon.astype(np.float64).to_value(u.rad), u.rad),
+        u.Quantity(lat.astype(np.float64).to_value(u.rad), u.rad),
+        depth,
+        return_offsets=True,
+    )
+    assert (ipix == expected_ipix).all()
+    assert np.allclose(dx, expected_dx, rtol=0, atol=1e-9)
+    assert np.allclose(dy, expected_dy, rtol=0, atol=1e-9)
+
+def test_lonlat_to_healpix_multi_depth():
+    size = 1000
+    depths = np.array([0, 5, 12, 29])
+    lon = np.random.rand(size) * 360 * u.deg
+    lat = (np.random.rand(size) * 178 - 89) * u.deg
+
+    ipix, dx, dy = lonlat_to_healpix(lon, lat, depths, return_offsets=True)
+    assert ipix.shape == (depths.shape[0], size)
+
+    for i, depth in enumerate(depths):
+        expected_ipix, expected_dx, expected_dy = lonlat_to_healpix(lon, lat, depth, return_offsets=True)
+        assert (ipix[i] == expected_ipix).all()
+        assert (dx[i] == expected_dx).all()
+        assert (dy[i] == expected_dy).all()
+
+    with pytest.raises(ValueError):
+        lonlat_to_healpix(lon, lat, np.array([5, 30]))
+
+@pytest.mark.parametrize("depth", [0, 12, 29])
+def test_scalar_lonlat_to_healpix(depth):
+    lon = np.random.rand(1)[0] * 360 * u.deg
+    lat = (np.random.rand(1)[0] * 178 - 89) * u.deg
+
+    ipix, dx, dy = lonlat_to_healpix(lon, lat, depth, return_offsets=True)
+    expected_ipix, expected_dx, expected_dy = lonlat_to_healpix([lon.value] * lon.unit, [lat.value] * lat.unit, depth, return_offsets=True)
+    assert ipix.shape == (1,)
+    assert (ipix == expected_ipix).all()
+    assert (dx == expected_dx).all()
+    assert (dy == expected_dy).all()
+
+    # Hashing the same position again returns the cached cell
+    from ..nested.healpix import _lonlat_to_healpix_scalar
+    hits = _lonlat_to_healpix_scalar.cache_info().hits
+    assert (lonlat_to_healpix(lon, lat, depth) == ipix).all()
+    assert _lonlat_to_healpix_scalar.cache_info().hits == hits + 1
+
+    lon, lat = healpix_to_lonlat(ipix[0], depth)
+    expected_lon, expected_lat = healpix_to_lonlat(ipix, depth)
+    assert lon.shape == (1,)
+    assert (lon == expected_lon).all()
+    assert (lat == expected_lat).all()
+
+def test_numpy_depth():
+    depth = np.array(5)
+    ipix = np.arange(12 * 4 ** 5, step=7, dtype=np.uint64)
+    lon, lat = healpix_to_lonlat(ipix, 5)
+    assert (lonlat_to_healpix(lon, lat, depth) == ipix).all()
+    assert (lonlat_to_healpix(lon[0], lat[0], depth) == ipix[:1]).all()
+
+    with pytest.raises(ValueError):
+        healpix_to_lonlat(12 * 4 ** depth, depth)
+
 def test_healpix_to_lonlat_on_brocasted_arrays():
     depth = 12
     x = np.arange(1000000)
@@ -98,11 +235,28 @@ def test_invalid_ipix_exception(depth):
     with pytest.raises(Exception):
         neighbours(invalid_ipix1, depth)
 
+def test_skip_ipix_check():
+    depth = 12
+    ipixels = np.random.randint(12 * 4 ** depth, size=1000, dtype="uint64")
+
+    lon, lat = healpix_to_lonlat(ipixels, depth)
+    lon_unchecked, lat_unchecked = healpix_to_lonlat(ipixels, depth, check=False)
+    assert (lon == lon_unchecked).all()
+    assert (lat == lat_unchecked).all()
+    assert (neighbours(ipixels, depth) == neighbours(ipixels, depth, check=False)).all()
+    assert (to_ring(ipixels, depth) == to_ring(ipixels, depth, check=False)).all()
+
 def test_healpix_to_skycoord():
     ipix = np.array([0, 2, 4])
     skycoord = healpix_to_skycoord(ipix=ipix, depth=0)
     assert(skycoord.icrs.ra.shape == skycoord.icrs.dec.shape)
 
+    lon, lat = healpix_to_lonlat(ipix=ipix, depth=0)
+    expected = SkyCoord(ra=lon, dec=lat, frame="icrs")
+    assert skycoord.frame.name == "icrs"
+    assert (skycoord.ra == expected.ra).all()
+    assert (skycoord.dec == expected.dec).all()
+
 def test_vertices_lonlat():
     depth = 12
     size = 100000
@@ -123,6 +277,18 @@ def test_neighbours():
     npix = 12 * 4**(depth)
     assert(((neigh >= -1) & (neigh < npix)).all())
 
+    # Each direction is stored contiguously
+    assert neigh[:, 8].flags['C_CONTIGUOUS']
+    assert (neigh[:, 4] == ipixels).all()
+
+    # The layout returned by default is also accepted as output
+    out = np.empty((9, size), dtype=np.int64).T
+    assert neighbours(ipixels, depth, out=out) is out
+    assert (out == neigh).all()
+
+    # A single cell goes through the scalar path
+    assert (neighbours(ipixels[0], depth) == neigh[:1]).all()
+
 def test_cone_search():
     lon = np.random.rand(1)[0] * 360 * u.deg
     lat = (np.random.rand(1)[0] * 178 - 89) * u.deg
@@ -138,6 +304,28 @@ def test_cone_search():
     with pytest.raises(Exception):
         cone_search([5, 4] * u.deg, [5, 4] * u.deg, 15 * u.deg, 12)
 
+@pytest.mark.parametrize("flat", [False, True])
+def test_multi_cone_search(flat):
+    size = 50
+    lon = np.random.rand(size) * 360 * u.deg
+    lat = (np.random.rand(size) * 178 - 89) * u.deg
+    radius = (np.random.rand(size) * 10) * u.deg
+    max_depth = 7
+
+    offsets, ipix, depth, fully_covered = multi_cone_search(lon=lon, lat=lat, radius=radius, depth=max_depth, flat=flat)
+    assert offsets.shape == (size + 1,)
+    assert offsets[-1] == ipix.shape[0] == depth.shape[0] == fully_covered.shape[0]
+
+    for i in range(size):
+        expected_ipix, expected_depth, expected_fully_covered = cone_search(lon=lon[i], lat=lat[i], radius=radius[i], depth=max_depth, flat=flat)
+        cone = slice(offsets[i], offsets[i + 1])
+        assert (ipix[cone] == expected_ipix).all()
+        assert (depth[cone] == expected_depth).all()
+        assert (fully_covered[cone] == expected_fully_covered).all()
+
+    with pytest.raises(ValueError):
+        multi_cone_search(lon, lat, [1, 2] * u.deg, max_depth)
+
 @pytest.mark.parametrize("size", [0, 1, 2, 3, 5, 6, 9])
 def test_polygon_search(size):
     max_depth = 12
@@ -28,6 +28,9 @@ def test_lonlat_to_healpix(size):
     assert(((ipixels >= 0) & (ipixels < npix)).all())
     assert(((dx >= 0) & (dx <= 1)).all())
 
+    # Without the offsets, the same cells are returned
+    assert (lonlat_to_healpix(lon=lon, lat=lat, nside=nside) == ipixels).all()
+
 @pytest.mark.parametrize("lon, lat, expected_ipix", [
     (5*u.deg, 5*u.deg, 12),
     (180*u.deg, 5*u.deg, 16),
@@ -59,6 +62,10 @@ def test_healpix_vs_lonlat(nside):
     ipixels_result, dx, dy = lonlat_to_healpix(lon=lon, lat=lat, nside=nside, return_offsets=True)
     assert((ipixels == ipixels_result).all())
 
+    lon, lat = healpix_to_lonlat(ipix=ipixels, nside=nside, raw=True)
+    assert type(lon) is np.ndarray and type(lat) is np.ndarray
+    assert (lonlat_to_healpix(lon=lon, lat=lat, nside=nside, raw=True) == ipixels).all()
+
 @pytest.mark.parametrize("size", [1, 10, 100, 1000, 10000, 100000])
 def test_healpix_to_xy_robust(size):
     depth = np.random.randint(30)
@@ -95,3 +102,126 @@ def test_vertices_lonlat(size):
     lon, lat = vertices(ipix=ipixels, nside=nside)
     assert(lon.shape == lat.shape)
     assert(lon.shape == (size, 4))
+    # Each vertex is stored contiguously
+    assert lon[:, 0].flags['C_CONTIGUOUS']
+
+@pytest.mark.parametrize("ipix", [
+    np.array([0, -1], dtype=np.int64),
+    np.array([0, -1], dtype=np.int32),
+    np.array([0, 12 * 3 * 3], dtype=np.int64),
+    np.array([0, 12 * 3 * 3], dtype=np.uint64),
+])
+def test_invalid_ipix(ipix):
+    with pytest.raises(ValueError):
+        healpix_to_lonlat(ipix, 3)
+    with pytest.raises(ValueError):
+        healpix_to_xy(ipix, 3)
+
+@pytest.mark.parametrize("nside", [1, 3, 1 << 12, 1 << 29])
+def test_scalar_path(nside):
+    lon = np.random.rand(1)[0] * 360 * u.deg
+    lat = (np.random.rand(1)[0] * 178 - 89) * u.deg
+
+    ipix, dx, dy = lonlat_to_healpix(lon, lat, nside, return_offsets=True)
+    expected_ipix, expected_dx, expected_dy = lonlat_to_healpix([lon.value] * lon.unit, [lat.value] * lat.unit, nside, return_offsets=True)
+    assert ipix.shape == (1,)
+    assert (ipix == expected_ipix).all()
+    assert (dx == expected_dx).all()
+    assert (dy == expected_dy).all()
+
+    lon, lat = healpix_to_lonlat(ipix[0], nside)
+    expected_lon, expected_lat = healpix_to_lonlat(ipix, nside)
+    assert lon.shape == (1,)
+    assert (lon == expected_lon).all()
+    assert (lat == expected_lat).all()
+
+    x, y = healpix_to_xy(ipix[0], nside)
+    expected_x, expected_y = healpix_to_xy(ipix, nside)
+    assert x.shape == (1,)
+    assert (x == expected_x).all()
+    assert (y == expected_y).all()
+
+    with pytest.raises(ValueError):
+        healpix_to_lonlat(12 * nside * nside, nside)
+
+def test_out():
+    nside = 1 << 12
+    size = 1000
+    lon = np.random.rand(size) * 360 * u.deg
+    lat = (np.random.rand(size) * 178 - 89) * u.deg
+
+    ipix = np.empty(size, dtype=np.uint64)
+    dx = np.empty(size, dtype=np.float64)
+    dy = np.empty(size, dtype=np.float64)
+    result = lonlat_to_healpix(lon, lat, nside, return_offsets=True, out=(ipix, dx, dy))
+    assert result[0] is ipix
+    assert (ipix == lonlat_to_healpix(lon, lat, nside)).all()
+
+    lon_out = np.empty(size, dtype=np.float64)
+    lat_out = np.empty(size, dtype=np.float64)
+    lon, lat = healpix_to_lonlat(ipix, nside, out=(lon_out, lat_out))
+    expected_lon, expected_lat = healpix_to_lonlat(ipix, nside)
+    assert (lon_out == expected_lon.value).all()
+    assert (lat_out == expected_lat.value).all()
+
+    lon_out = np.empty((size, 4), dtype=np.float64)
+    lat_out = np.empty((size, 4), dtype=np.float64)
+    vertices(ipix, nside, out=(lon_out, lat_out))
+    expected_lon, expected_lat = vertices(ipix, nside)
+    assert (lon_out == expected_lon.value).all()
+    assert (lat_out == expected_lat.value).all()
+
+    lon_out = np.empty((4, size), dtype=np.float64).T
+    lat_out = np.empty((4, size), dtype=np.float64).T
+    vertices(ipix, nside, out=(lon_out, lat_out))
+    assert (lon_out == expected_lon.value).all()
+    assert (lat_out == expected_lat.value).all()
+
+    with pytest.raises(ValueError):
+        healpix_to_xy(ipix, nside, out=(np.empty(size, dtype=np.float32), np.empty(size)))
+
+def test_no_check():
+    nside = 1 << 10
+    ipix = np.arange(12 * nside * nside, step=997, dtype=np.uint64)
+
+    lon, lat = healpix_to_lonlat(ipix, nside, check=False)
+    expected_lon, expected_lat = healpix_to_lonlat(ipix, nside)
+    assert (lon == expected_lon).all()
+    assert (lat == expected_lat).all()
+
+    x, y = healpix_to_xy(ipix, nside, check=False)
+    expected_x, expected_y = healpix_to_xy(ipix, nside)
+    assert (x == expected_x).all()
+    assert (y == expected_y).all()
+
+@pytest.mark.parametrize("nside", [1, 3, 16, 100, 1 << 12, 1 << 29])
+def test_lonlat_to_healpix_paths_agree(nside):
+    size = 1000
+    lon = np.random.rand(size) * 360 * u.deg
+    lat = (np.random.rand(size) * 180 - 90) * u.deg
+
+    ipixels, _, _ = lonlat_to_healpix(lon=lon, lat=lat, nside=nside, return_offsets=True)
+    assert (lonlat_to_healpix(lon=lon, lat=lat, nside=nside) == ipixels).all()
+
+    # Cell vertices lie on the cell boundaries, all the paths must
+    # assign them to the same cells
+    ipix = np.random.randint(12 * nside * nside, size=100, dtype="uint64")
+    lon, lat = vertices(ipix, nside)
+    lon = lon.ravel()
+    lat = lat.ravel()
+    ipixels, _, _ = lonlat_to_healpix(lon=lon, lat=lat, nside=nside, return_offsets=True)
+    assert (lonlat_to_healpix(lon=lon, lat=lat, nside=nside) == ipixels).all()
+    for i in range(0, lon.size, 37):
+        assert lonlat_to_healpix(lon=lon[i], lat=lat[i], nside=nside)[0] == ipixels[i]
+
+def test_numpy_nside():
+    nside = np.array(1 << 5)
+    ipix = np.arange(12 * 32 * 32, step=7, dtype=np.uint64)
+    lon, lat = healpix_to_lonlat(ipix, nside)
+    assert (lonlat_to_healpix(lon, lat, nside) == ipix).all()
+
+def test_float_nside():
+    with pytest.raises(TypeError):
+        lonlat_to_healpix([10] * u.deg, [10] * u.deg, 2.5)
+    with pytest.raises(TypeError):
+        healpix_to_lonlat(np.arange(10, dtype=np.uint64), 2.5)
@@ -1,16 +1,10 @@
 import numpy as np
 
 from . import cdshealpix # noqa
+from ._common import _check_ipixels, _as_u64, _atleast_1d
 
-# Raise a ValueError exception if the input 
-# HEALPix cells array contains invalid values
-def _check_ipixels(data, depth):
-    npix = 12 * 4 ** (depth)
-    if (data >= npix).any() or (data < 0).any():
-        raise ValueError("The input HEALPix cells contains value out of [0, {0}]".format(npix - 1))
 
-
-def to_ring(ipix, depth):
+def to_ring(ipix, depth, check=True):
     """Convert HEALPix cells from the NESTED to the RING scheme
 
     Parameters
@@ -19,6 +13,10 @@ def to_ring(ipix, depth):
         The HEALPix cell indexes in the NESTED scheme.
     depth : int
         The depth of the HEALPix cells.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -41,9 +39,10 @@ def to_ring(ipix, depth):
     if depth < 0 or depth > 29:
         raise ValueError("Depth must be in the [0, 29] closed range")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, depth=depth)
-    ipix = ipix.astype(np.uint64)
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels(data=ipix, depth=depth)
+    ipix = _as_u64(ipix)
     
     # Allocation of the array containing the cells under the RING scheme
     ipix_ring = np.zeros(ipix.shape, dtype=np.uint64)
@@ -51,7 +50,7 @@ def to_ring(ipix, depth):
 
     return ipix_ring
 
-def from_ring(ipix, depth):
+def from_ring(ipix, depth, check=True):
     """Convert HEALPix cells from the RING to the NESTED scheme
 
     Parameters
@@ -60,6 +59,10 @@ def from_ring(ipix, depth):
         The HEALPix cell indexes in the RING scheme.
     depth : int
         The depth of the HEALPix cells.
+    check : bool, optional
+        Whether to check that the values of ``ipix`` are valid HEALPix cell indexes. `True` by default.
+        Only disable it when ``ipix`` is known to be valid (e.g. it has been computed by this package)
+        to save one pass over the input array.
 
     Returns
     -------
@@ -82,9 +85,10 @@ def from_ring(ipix, depth):
     if depth < 0 or depth > 29:
         raise ValueError("Depth must be in the [0, 29] closed range")
 
-    ipix = np.atleast_1d(ipix)
-    _check_ipixels(data=ipix, depth=depth)
-    ipix = ipix.astype(np.uint64)
+    ipix = _atleast_1d(ipix)
+    if check:
+        _check_ipixels(data=ipix, depth=depth)
+    ipix = _as_u64(ipix)
     
     # Allocation of the array containing the cells under the NESTED scheme
     ipix_nested = np.zeros(ipix.shape, dtype=np.uint64)
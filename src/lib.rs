@@ -2,12 +2,14 @@ extern crate healpix;
 
 extern crate ndarray;
 extern crate ndarray_parallel;
+extern crate rayon;
 
 extern crate numpy;
 extern crate pyo3;
 
-use ndarray::{Array1, Zip};
+use ndarray::{Array1, ArrayD, ArrayViewMut1, IxDyn, Zip};
 use ndarray_parallel::prelude::*;
+use rayon::prelude::*;
 
 use numpy::{IntoPyArray, PyArrayDyn, PyArray1};
 use pyo3::prelude::{pymodule, Py, PyModule, PyResult, Python};
@@ -24,6 +26,13 @@ use healpix::compass_point::{MainWind, Cardinal, Ordinal};
 /// ndarray also offers a way to zip arrays (immutably and mutably) and
 /// operate on them element-wisely. This is done in parallel using the
 /// ndarray-parallel crate that offers the par_apply method on zipped arrays.
+/// The longest kernels release the GIL while they run so that other Python
+/// threads can make progress.
+
+/// Below this number of cells, the element-wise kernels run on the calling
+/// thread: dispatching a small batch to the rayon thread pool costs more
+/// than the computation itself.
+const PARALLEL_THRESHOLD: usize = 1 << 14;
 
 #[pymodule]
 fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
@@ -67,7 +76,7 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
 
     /// wrapper of `lonlat_to_healpix`
     #[pyfn(m, "lonlat_to_healpix")]
-    fn lonlat_to_healpix(_py: Python,
+    fn lonlat_to_healpix(py: Python,
         depth: u8,
         lon: &PyArrayDyn<f64>,
         lat: &PyArrayDyn<f64>,
@@ -81,24 +90,123 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let mut dx = dx.as_array_mut();
         let mut dy = dy.as_array_mut();
 
-        let layer = healpix::nested::get_or_create(depth);
-        Zip::from(&mut ipix)
-            .and(&mut dx)
-            .and(&mut dy)
-            .and(&lon)
-            .and(&lat)
-            .par_apply(|p, x, y, &lon, &lat| {
+        py.allow_threads(|| {
+            let layer = healpix::nested::get_or_create(depth);
+            let zip = Zip::from(&mut ipix)
+                .and(&mut dx)
+                .and(&mut dy)
+                .and(&lon)
+                .and(&lat);
+            let hash = |p: &mut u64, x: &mut f64, y: &mut f64, &lon: &f64, &lat: &f64| {
                 let r = layer.hash_with_dxdy(lon, lat);
                 *p = r.0;
                 *x = r.1;
                 *y = r.2;
-            });
+            };
+            if lon.len() < PARALLEL_THRESHOLD {
+                zip.apply(hash);
+            } else {
+                zip.par_apply(hash);
+            }
+        });
+
+        Ok(())
+    }
+
+    /// wrapper of `hash`
+    /// Same as `lonlat_to_healpix` without the computation and
+    /// the writing of the offsets of the positions in their cells.
+    #[pyfn(m, "lonlat_to_healpix_ipix")]
+    fn lonlat_to_healpix_ipix(py: Python,
+        depth: u8,
+        lon: &PyArrayDyn<f64>,
+        lat: &PyArrayDyn<f64>,
+        ipix: &PyArrayDyn<u64>)
+    -> PyResult<()> {
+        let lon = lon.as_array();
+        let lat = lat.as_array();
+        let mut ipix = ipix.as_array_mut();
+
+        py.allow_threads(|| {
+            let layer = healpix::nested::get_or_create(depth);
+            let zip = Zip::from(&mut ipix)
+                .and(&lon)
+                .and(&lat);
+            let hash = |p: &mut u64, &lon: &f64, &lat: &f64| {
+                *p = layer.hash(lon, lat);
+            };
+            if lon.len() < PARALLEL_THRESHOLD {
+                zip.apply(hash);
+            } else {
+                zip.par_apply(hash);
+            }
+        });
+
+        Ok(())
+    }
+
+    /// wrapper of `lonlat_to_healpix` hashing the same positions at
+    /// several depths. The first axis of `ipix`, `dx` and `dy` runs
+    /// over `depths`, the remaining ones have the shape of `lon`.
+    #[pyfn(m, "lonlat_to_healpix_multi_depth")]
+    fn lonlat_to_healpix_multi_depth(py: Python,
+        depths: &PyArrayDyn<u8>,
+        lon: &PyArrayDyn<f64>,
+        lat: &PyArrayDyn<f64>,
+        ipix: &PyArrayDyn<u64>,
+        dx: &PyArrayDyn<f64>,
+        dy: &PyArrayDyn<f64>)
+    -> PyResult<()> {
+        let depths = depths.as_array();
+        let lon = lon.as_array();
+        let lat = lat.as_array();
+        let mut ipix = ipix.as_array_mut();
+        let mut dx = dx.as_array_mut();
+        let mut dy = dy.as_array_mut();
+
+        py.allow_threads(|| {
+            let parallel = lon.len() >= PARALLEL_THRESHOLD;
+            for (((&depth, mut ipix), mut dx), mut dy) in depths.iter()
+                .zip(ipix.outer_iter_mut())
+                .zip(dx.outer_iter_mut())
+                .zip(dy.outer_iter_mut()) {
+                let layer = healpix::nested::get_or_create(depth);
+                let zip = Zip::from(&mut ipix)
+                    .and(&mut dx)
+                    .and(&mut dy)
+                    .and(&lon)
+                    .and(&lat);
+                let hash = |p: &mut u64, x: &mut f64, y: &mut f64, &lon: &f64, &lat: &f64| {
+                    let r = layer.hash_with_dxdy(lon, lat);
+                    *p = r.0;
+                    *x = r.1;
+                    *y = r.2;
+                };
+                if parallel {
+                    zip.par_apply(hash);
+                } else {
+                    zip.apply(hash);
+                }
+            }
+        });
 
         Ok(())
     }
 
+    /// Scalar version of `lonlat_to_healpix` returning the
+    /// (ipix, dx, dy) tuple of a single position
+    #[pyfn(m, "lonlat_to_healpix_scalar")]
+    fn lonlat_to_healpix_scalar(_py: Python,
+        depth: u8,
+        lon: f64,
+        lat: f64)
+    -> PyResult<(u64, f64, f64)> {
+        let layer = healpix::nested::get_or_create(depth);
+        Ok(layer.hash_with_dxdy(lon, lat))
+    }
+
     #[pyfn(m, "lonlat_to_healpix_ring")]
-    fn lonlat_to_healpix_ring(_py: Python,
+    fn lonlat_to_healpix_ring(py: Python,
         nside: u32,
         lon: &PyArrayDyn<f64>,
         lat: &PyArrayDyn<f64>,
@@ -112,24 +220,73 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let mut dx = dx.as_array_mut();
         let mut dy = dy.as_array_mut();
 
-        Zip::from(&mut ipix)
-            .and(&mut dx)
-            .and(&mut dy)
-            .and(&lon)
-            .and(&lat)
-            .par_apply(|p, x, y, &lon, &lat| {
+        py.allow_threads(|| {
+            let zip = Zip::from(&mut ipix)
+                .and(&mut dx)
+                .and(&mut dy)
+                .and(&lon)
+                .and(&lat);
+            let hash = |p: &mut u64, x: &mut f64, y: &mut f64, &lon: &f64, &lat: &f64| {
                 let r = healpix::ring::hash_with_dxdy(nside, lon, lat);
                 *p = r.0;
                 *x = r.1;
                 *y = r.2;
-            });
+            };
+            if lon.len() < PARALLEL_THRESHOLD {
+                zip.apply(hash);
+            } else {
+                zip.par_apply(hash);
+            }
+        });
+
+        Ok(())
+    }
+
+    /// wrapper of `ring::hash`
+    /// Same as `lonlat_to_healpix_ring` without the computation and
+    /// the writing of the offsets of the positions in their cells.
+    #[pyfn(m, "lonlat_to_healpix_ring_ipix")]
+    fn lonlat_to_healpix_ring_ipix(py: Python,
+        nside: u32,
+        lon: &PyArrayDyn<f64>,
+        lat: &PyArrayDyn<f64>,
+        ipix: &PyArrayDyn<u64>)
+    -> PyResult<()> {
+        let lon = lon.as_array();
+        let lat = lat.as_array();
+        let mut ipix = ipix.as_array_mut();
+
+        py.allow_threads(|| {
+            let zip = Zip::from(&mut ipix)
+                .and(&lon)
+                .and(&lat);
+            let hash = |p: &mut u64, &lon: &f64, &lat: &f64| {
+                *p = healpix::ring::hash(nside, lon, lat);
+            };
+            if lon.len() < PARALLEL_THRESHOLD {
+                zip.apply(hash);
+            } else {
+                zip.par_apply(hash);
+            }
+        });
 
         Ok(())
     }
 
+    /// Scalar version of `lonlat_to_healpix_ring` returning the
+    /// (ipix, dx, dy) tuple of a single position
+    #[pyfn(m, "lonlat_to_healpix_ring_scalar")]
+    fn lonlat_to_healpix_ring_scalar(_py: Python,
+        nside: u32,
+        lon: f64,
+        lat: f64)
+    -> PyResult<(u64, f64, f64)> {
+        Ok(healpix::ring::hash_with_dxdy(nside, lon, lat))
+    }
+
     /// wrapper of `healpix_to_lonlat`
     #[pyfn(m, "healpix_to_lonlat")]
-    fn healpix_to_lonlat(_py: Python,
+    fn healpix_to_lonlat(py: Python,
         depth: u8,
         ipix: &PyArrayDyn<u64>,
         dx: f64,
@@ -141,20 +298,52 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let mut lat = lat.as_array_mut();
         let ipix = ipix.as_array();
 
-        let layer = healpix::nested::get_or_create(depth);
-        Zip::from(&ipix)
-            .and(&mut lon)
-            .and(&mut lat)
-            .par_apply(|&p, lon, lat| {
+        py.allow_threads(|| {
+            let layer = healpix::nested::get_or_create(depth);
+            let zip = Zip::from(&ipix)
+                .and(&mut lon)
+                .and(&mut lat);
+            let center = |&p: &u64, lon: &mut f64, lat: &mut f64| {
                 let (l, b) = layer.sph_coo(p, dx, dy);
                 *lon = l;
                 *lat = b;
-            });
+            };
+            if ipix.len() < PARALLEL_THRESHOLD {
+                zip.apply(center);
+            } else {
+                zip.par_apply(center);
+            }
+        });
 
         Ok(())
     }
+    /// Scalar version of `healpix_to_lonlat` returning the
+    /// (lon, lat) tuple of a single cell
+    #[pyfn(m, "healpix_to_lonlat_scalar")]
+    fn healpix_to_lonlat_scalar(_py: Python,
+        depth: u8,
+        ipix: u64,
+        dx: f64,
+        dy: f64)
+    -> PyResult<(f64, f64)> {
+        let layer = healpix::nested::get_or_create(depth);
+        Ok(layer.sph_coo(ipix, dx, dy))
+    }
+
+    /// Scalar version of `healpix_to_lonlat_ring` returning the
+    /// (lon, lat) tuple of a single cell
+    #[pyfn(m, "healpix_to_lonlat_ring_scalar")]
+    fn healpix_to_lonlat_ring_scalar(_py: Python,
+        nside: u32,
+        ipix: u64,
+        dx: f64,
+        dy: f64)
+    -> PyResult<(f64, f64)> {
+        Ok(healpix::ring::sph_coo(nside, ipix, dx, dy))
+    }
+
     #[pyfn(m, "healpix_to_lonlat_ring")]
-    fn healpix_to_lonlat_ring(_py: Python,
+    fn healpix_to_lonlat_ring(py: Python,
         nside: u32,
         ipix: &PyArrayDyn<u64>,
         dx: f64,
@@ -166,14 +355,21 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let mut lat = lat.as_array_mut();
         let ipix = ipix.as_array();
 
-        Zip::from(&ipix)
-            .and(&mut lon)
-            .and(&mut lat)
-            .par_apply(|&p, lon, lat| {
+        py.allow_threads(|| {
+            let zip = Zip::from(&ipix)
+                .and(&mut lon)
+                .and(&mut lat);
+            let center = |&p: &u64, lon: &mut f64, lat: &mut f64| {
                 let (l, b) = healpix::ring::sph_coo(nside, p, dx, dy);
                 *lon = l;
                 *lat = b;
-            });
+            };
+            if ipix.len() < PARALLEL_THRESHOLD {
+                zip.apply(center);
+            } else {
+                zip.par_apply(center);
+            }
+        });
 
         Ok(())
     }
@@ -203,7 +399,7 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         Ok(())
     }
     #[pyfn(m, "healpix_to_xy_ring")]
-    fn healpix_to_xy_ring(_py: Python,
+    fn healpix_to_xy_ring(py: Python,
         nside: u32,
         ipix: &PyArrayDyn<u64>,
         x: &PyArrayDyn<f64>,
@@ -213,18 +409,35 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let mut y = y.as_array_mut();
         let ipix = ipix.as_array();
 
-        Zip::from(&ipix)
-            .and(&mut x)
-            .and(&mut y)
-            .par_apply(|&p, hpx, hpy| {
+        py.allow_threads(|| {
+            let zip = Zip::from(&ipix)
+                .and(&mut x)
+                .and(&mut y);
+            let project = |&p: &u64, hpx: &mut f64, hpy: &mut f64| {
                 let (x, y) = healpix::ring::center_of_projected_cell(nside, p);
                 *hpx = x;
                 *hpy = y;
-            });
+            };
+            if ipix.len() < PARALLEL_THRESHOLD {
+                zip.apply(project);
+            } else {
+                zip.par_apply(project);
+            }
+        });
 
         Ok(())
     }
 
+    /// Scalar version of `healpix_to_xy_ring` returning the
+    /// (x, y) tuple of a single cell
+    #[pyfn(m, "healpix_to_xy_ring_scalar")]
+    fn healpix_to_xy_ring_scalar(_py: Python,
+        nside: u32,
+        ipix: u64)
+    -> PyResult<(f64, f64)> {
+        Ok(healpix::ring::center_of_projected_cell(nside, ipix))
+    }
+
     /// wrapper of `lonlat_to_xy`
     #[pyfn(m, "lonlat_to_xy")]
     fn lonlat_to_xy(_py: Python,
@@ -279,7 +492,7 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
 
     /// wrapper of `vertices`
     #[pyfn(m, "vertices")]
-    fn vertices(_py: Python,
+    fn vertices(py: Python,
         depth: u8,
         ipix: &PyArrayDyn<u64>,
         step: usize,
@@ -290,13 +503,15 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let mut lon = lon.as_array_mut();
         let mut lat = lat.as_array_mut();
 
-        let layer = healpix::nested::get_or_create(depth);
-        if step == 1 {
-            Zip::from(lon.genrows_mut())
+        py.allow_threads(|| {
+            let layer = healpix::nested::get_or_create(depth);
+            let parallel = ipix.len() >= PARALLEL_THRESHOLD;
+            let zip = Zip::from(lon.genrows_mut())
                 .and(lat.genrows_mut())
-                .and(&ipix)
-                .par_apply(|mut lon, mut lat, &p| {
-                    let [(s_lon, s_lat), (e_lon, e_lat), (n_lon, n_lat), (w_lon, w_lat)] = healpix::nested::vertices(depth, p);
+                .and(&ipix);
+            if step == 1 {
+                let vertices = |mut lon: ArrayViewMut1<f64>, mut lat: ArrayViewMut1<f64>, &p: &u64| {
+                    let [(s_lon, s_lat), (e_lon, e_lat), (n_lon, n_lat), (w_lon, w_lat)] = layer.vertices(p);
                     lon[0] = s_lon;
                     lat[0] = s_lat;
 
@@ -308,12 +523,14 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
 
                     lon[3] = w_lon;
                     lat[3] = w_lat;
-                });
-        } else {
-            Zip::from(lon.genrows_mut())
-                .and(lat.genrows_mut())
-                .and(&ipix)
-                .par_apply(|mut lon, mut lat, &p| {
+                };
+                if parallel {
+                    zip.par_apply(vertices);
+                } else {
+                    zip.apply(vertices);
+                }
+            } else {
+                let path = |mut lon: ArrayViewMut1<f64>, mut lat: ArrayViewMut1<f64>, &p: &u64| {
                     let r = layer.path_along_cell_edge(p, &Cardinal::S, false, step as u32);
 
                     for i in 0..(4*step) {
@@ -321,13 +538,19 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
                         lon[i] = l;
                         lat[i] = b;
                     }
-                });
-        }
+                };
+                if parallel {
+                    zip.par_apply(path);
+                } else {
+                    zip.apply(path);
+                }
+            }
+        });
 
         Ok(())
     }
     #[pyfn(m, "vertices_ring")]
-    fn vertices_ring(_py: Python,
+    fn vertices_ring(py: Python,
         nside: u32,
         ipix: &PyArrayDyn<u64>,
         step: usize,
@@ -338,10 +561,11 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let mut lon = lon.as_array_mut();
         let mut lat = lat.as_array_mut();
 
-        Zip::from(lon.genrows_mut())
-            .and(lat.genrows_mut())
-            .and(&ipix)
-            .par_apply(|mut lon, mut lat, &p| {
+        py.allow_threads(|| {
+            let zip = Zip::from(lon.genrows_mut())
+                .and(lat.genrows_mut())
+                .and(&ipix);
+            let vertices = |mut lon: ArrayViewMut1<f64>, mut lat: ArrayViewMut1<f64>, &p: &u64| {
                 let [(s_lon, s_lat), (e_lon, e_lat), (n_lon, n_lat), (w_lon, w_lat)] = healpix::ring::vertices(nside, p);
                 lon[0] = s_lon;
                 lat[0] = s_lat;
@@ -354,7 +578,13 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
 
                 lon[3] = w_lon;
                 lat[3] = w_lat;
-            });
+            };
+            if ipix.len() < PARALLEL_THRESHOLD {
+                zip.apply(vertices);
+            } else {
+                zip.par_apply(vertices);
+            }
+        });
 
         Ok(())
     }
@@ -362,8 +592,9 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
     /// Wrapper of `neighbours`
     /// The given array must be of size 9
     /// `[S, SE, E, SW, C, NE, W, NW, N]`
+    /// along its last axis, which does not need to be contiguous.
     #[pyfn(m, "neighbours")]
-    fn neighbours(_py: Python,
+    fn neighbours(py: Python,
         depth: u8,
         ipix: &PyArrayDyn<u64>,
         neighbours: &PyArrayDyn<i64>)
@@ -371,25 +602,34 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         let ipix = ipix.as_array();
         let mut neighbours = neighbours.as_array_mut();
 
-        Zip::from(neighbours.genrows_mut())
-            .and(&ipix)
-            .par_apply(|mut n, &p| {
-                let map = healpix::nested::neighbours(depth, p, true);
-
-                n[0] = to_ref_i64(map.get(MainWind::S));
-                n[1] = to_ref_i64(map.get(MainWind::SE));
-                n[2] = to_ref_i64(map.get(MainWind::E));
-                n[3] = to_ref_i64(map.get(MainWind::SW));
-                n[4] = p as i64;
-                n[5] = to_ref_i64(map.get(MainWind::NE));
-                n[6] = to_ref_i64(map.get(MainWind::W));
-                n[7] = to_ref_i64(map.get(MainWind::NW));
-                n[8] = to_ref_i64(map.get(MainWind::N));
-            });
+        py.allow_threads(|| {
+            let zip = Zip::from(neighbours.genrows_mut())
+                .and(&ipix);
+            let fill = |mut row: ArrayViewMut1<i64>, &p: &u64| {
+                for (n, &v) in row.iter_mut().zip(neighbours_of(depth, p).iter()) {
+                    *n = v;
+                }
+            };
+            if ipix.len() < PARALLEL_THRESHOLD {
+                zip.apply(fill);
+            } else {
+                zip.par_apply(fill);
+            }
+        });
 
         Ok(())
     }
 
+    /// Scalar version of `neighbours` returning the 9 cells
+    /// (the cell itself included) around a single cell
+    #[pyfn(m, "neighbours_scalar")]
+    fn neighbours_scalar(_py: Python,
+        depth: u8,
+        ipix: u64)
+    -> PyResult<Vec<i64>> {
+        Ok(neighbours_of(depth, ipix).to_vec())
+    }
+
     /// Cone search
     #[pyfn(m, "cone_search")]
     fn cone_search(py: Python,
@@ -419,6 +659,66 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         fully_covered.into_pyarray(py).to_owned())
     }
 
+    /// Cone search over several cones
+    /// The cones are processed in parallel and their cells are
+    /// concatenated: the cells of the i-th cone are located
+    /// in `[offsets[i], offsets[i + 1][`.
+    #[pyfn(m, "multi_cone_search")]
+    fn multi_cone_search(py: Python,
+        depth: u8,
+        delta_depth: u8,
+        lon: &PyArrayDyn<f64>,
+        lat: &PyArrayDyn<f64>,
+        radius: &PyArrayDyn<f64>,
+        flat: bool)
+    -> (Py<PyArray1<u64>>, Py<PyArray1<u64>>, Py<PyArray1<u8>>, Py<PyArray1<bool>>) {
+        let cones = lon.as_array()
+            .iter()
+            .zip(lat.as_array().iter())
+            .zip(radius.as_array().iter())
+            .map(|((&lon, &lat), &radius)| (lon, lat, radius))
+            .collect::<Vec<(f64, f64, f64)>>();
+
+        let cells = py.allow_threads(|| {
+            cones.par_iter()
+                .map(|&(lon, lat, radius)| {
+                    let bmoc = healpix::nested::cone_coverage_approx_custom(
+                        depth,
+                        delta_depth,
+                        lon,
+                        lat,
+                        radius,
+                    );
+
+                    if flat {
+                        get_flat_cells(bmoc)
+                    } else {
+                        get_cells(bmoc)
+                    }
+                })
+                .collect::<Vec<(Array1<u64>, Array1<u8>, Array1<bool>)>>()
+        });
+
+        let len = cells.iter().map(|(ipix, _, _)| ipix.len()).sum();
+        let mut offsets = Vec::<u64>::with_capacity(cells.len() + 1);
+        let mut ipix = Vec::<u64>::with_capacity(len);
+        let mut depth = Vec::<u8>::with_capacity(len);
+        let mut fully_covered = Vec::<bool>::with_capacity(len);
+
+        offsets.push(0);
+        for (p, d, f) in cells {
+            ipix.extend(p.iter());
+            depth.extend(d.iter());
+            fully_covered.extend(f.iter());
+            offsets.push(ipix.len() as u64);
+        }
+
+        (Array1::from(offsets).into_pyarray(py).to_owned(),
+        Array1::from(ipix).into_pyarray(py).to_owned(),
+        Array1::from(depth).into_pyarray(py).to_owned(),
+        Array1::from(fully_covered).into_pyarray(py).to_owned())
+    }
+
     /// Elliptical cone search
     #[pyfn(m, "elliptical_cone_search")]
     fn elliptical_cone_search(py: Python,
@@ -488,24 +788,27 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
         fully_covered.into_pyarray(py).to_owned())
     }
 
+    /// Wrapper of `external_edge_struct`
+    /// The (edges, corners) arrays are allocated here and returned
+    /// to Python, their shape is the one of `ipix` with an extra
+    /// last axis of length `4 << delta_depth` for edges and 4 for corners.
     #[pyfn(m, "external_neighbours")]
-    fn external_neighbours(_py: Python,
+    fn external_neighbours(py: Python,
         depth: u8,
         delta_depth: u8,
-        ipix: &PyArrayDyn<u64>,
-        corners: &PyArrayDyn<i64>,
-        edges: &PyArrayDyn<u64>)
-    -> PyResult<()> {
+        ipix: &PyArrayDyn<u64>)
+    -> (Py<PyArrayDyn<u64>>, Py<PyArrayDyn<i64>>) {
         let ipix = ipix.as_array();
 
-        let mut corners = corners.as_array_mut();
-        let mut edges = edges.as_array_mut();
+        let mut corners = ArrayD::<i64>::zeros(with_last_axis(ipix.shape(), 4));
+        let mut edges = ArrayD::<u64>::zeros(with_last_axis(ipix.shape(), 4 << delta_depth));
 
         let layer = healpix::nested::get_or_create(depth);
-        Zip::from(corners.genrows_mut())
-            .and(edges.genrows_mut())
-            .and(&ipix)
-            .par_apply(|mut c, mut e, &p| {
+        py.allow_threads(|| {
+            let zip = Zip::from(corners.genrows_mut())
+                .and(edges.genrows_mut())
+                .and(&ipix);
+            let external_neighbours_of = |mut c: ArrayViewMut1<i64>, mut e: ArrayViewMut1<u64>, &p: &u64| {
                 let external_edges = layer.external_edge_struct(p, delta_depth);
 
                 c[0] = to_i64(external_edges.get_corner(&Cardinal::S));
@@ -541,34 +844,44 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
                 for i in 0..num_cells_per_edge {
                     e[offset + i] = sw_edge[i];
                 }
-            });
-
-        Ok(())
+            };
+            if ipix.len() < PARALLEL_THRESHOLD {
+                zip.apply(external_neighbours_of);
+            } else {
+                zip.par_apply(external_neighbours_of);
+            }
+        });
+
+        (edges.into_pyarray(py).to_owned(),
+        corners.into_pyarray(py).to_owned())
     }
 
     ////////////////////////////
     // Bilinear interpolation //
     ////////////////////////////
+    /// The (ipix, weights) arrays are allocated here and returned
+    /// to Python, their shape is the one of `lon` with an extra
+    /// last axis of length 4.
     #[pyfn(m, "bilinear_interpolation")]
-    fn bilinear_interpolation(_py: Python,
+    fn bilinear_interpolation(py: Python,
         depth: u8,
         lon: &PyArrayDyn<f64>,
-        lat: &PyArrayDyn<f64>,
-        ipix: &PyArrayDyn<u64>,
-        weights: &PyArrayDyn<f64>)
-    -> PyResult<()> {
+        lat: &PyArrayDyn<f64>)
+    -> (Py<PyArrayDyn<u64>>, Py<PyArrayDyn<f64>>) {
         let lon = lon.as_array();
         let lat = lat.as_array();
 
-        let mut ipix = ipix.as_array_mut();
-        let mut weights = weights.as_array_mut();
+        // Every element is written below, the arrays are not zeroed first
+        let mut ipix = unsafe { ArrayD::<u64>::uninitialized(with_last_axis(lon.shape(), 4)) };
+        let mut weights = unsafe { ArrayD::<f64>::uninitialized(with_last_axis(lon.shape(), 4)) };
 
         let layer = healpix::nested::get_or_create(depth);
-        Zip::from(ipix.genrows_mut())
-            .and(weights.genrows_mut())
-            .and(&lon)
-            .and(&lat)
-            .par_apply(|mut pix, mut w, &l, &b| {
+        py.allow_threads(|| {
+            let zip = Zip::from(ipix.genrows_mut())
+                .and(weights.genrows_mut())
+                .and(&lon)
+                .and(&lat);
+            let interpolate = |mut pix: ArrayViewMut1<u64>, mut w: ArrayViewMut1<f64>, &l: &f64, &b: &f64| {
                 let [(p1, w1), (p2, w2), (p3, w3), (p4, w4)] = layer.bilinear_interpolation(l, b);
 
                 pix[0] = p1;
@@ -580,14 +893,28 @@ fn cdshealpix(_py: Python, m: &PyModule) -> PyResult<()> {
                 w[1] = w2;
                 w[2] = w3;
                 w[3] = w4;
-            });
+            };
+            if lon.len() < PARALLEL_THRESHOLD {
+                zip.apply(interpolate);
+            } else {
+                zip.par_apply(interpolate);
+            }
+        });
 
-        Ok(())
+        (ipix.into_pyarray(py).to_owned(),
+        weights.into_pyarray(py).to_owned())
     }
 
     Ok(())
 }
 
+/// Returns the `shape` dimension extended by a last axis of length `len`
+fn with_last_axis(shape: &[usize], len: usize) -> IxDyn {
+    let mut shape = shape.to_vec();
+    shape.push(len);
+    IxDyn(&shape)
+}
+
 fn to_i64(val: Option<u64>) -> i64 {
     match val {
         Some(val) => val as i64,
@@ -595,6 +922,23 @@ fn to_i64(val: Option<u64>) -> i64 {
     }
 }
 
+/// The neighbours of the cell `p` ordered as in the rows of the
+/// `neighbours` output array, -1 standing for a missing neighbour
+fn neighbours_of(depth: u8, p: u64) -> [i64; 9] {
+    let map = healpix::nested::neighbours(depth, p, true);
+    [
+        to_ref_i64(map.get(MainWind::S)),
+        to_ref_i64(map.get(MainWind::SE)),
+        to_ref_i64(map.get(MainWind::E)),
+        to_ref_i64(map.get(MainWind::SW)),
+        p as i64,
+        to_ref_i64(map.get(MainWind::NE)),
+        to_ref_i64(map.get(MainWind::W)),
+        to_ref_i64(map.get(MainWind::NW)),
+        to_ref_i64(map.get(MainWind::N)),
+    ]
+}
+
 fn to_ref_i64(val: Option<&u64>) -> i64 {
     match val {
         Some(&val) => val as i64,